@@ -31,9 +31,11 @@ import threading
 import shlex
 import traceback
 import threading
-from threading import Thread, Semaphore, Lock, current_thread
+from threading import Thread, Lock, current_thread
 import builtins
 from functools import partial
+from collections import deque
+from concurrent.futures import Future
 
 import runtime
 from runtime.PyroServer import PyroServer
@@ -424,28 +426,45 @@ if enabletwisted:
 pyruntimevars = {}
 
 if havewx:
-    wx_eval_lock = Semaphore(0)
+    # (future, call) pending evaluation in wx main loop
+    wx_eval_queue = deque()
+    wx_eval_mutex = Lock()
+    wx_eval_scheduled = False
+    # max count of calls evaluated per wx event, to keep GUI responsive
+    wx_eval_batch = 16
 
     def statuschangeTskBar(status):
         wx.CallAfter(taskbar_instance.UpdateIcon, status)
 
     statuschange.append(statuschangeTskBar)
 
-    def wx_evaluator(obj, *args, **kwargs):
-        tocall, args, kwargs = obj.call
-        obj.res = default_evaluator(tocall, *args, **kwargs)
-        wx_eval_lock.release()
+    def wx_evaluator():
+        global wx_eval_scheduled
+        for _i in range(wx_eval_batch):
+            with wx_eval_mutex:
+                if not wx_eval_queue:
+                    wx_eval_scheduled = False
+                    return
+                future, (tocall, args, kwargs) = wx_eval_queue.popleft()
+            future.set_result(default_evaluator(tocall, *args, **kwargs))
+        # more may be pending, let wx handle other events meanwhile
+        wx.CallAfter(wx_evaluator)
 
     main_thread_id = current_thread().ident
     def evaluator(tocall, *args, **kwargs):
+        global wx_eval_scheduled
         # To prevent deadlocks, check if current thread is not one already main
         current_id = current_thread().ident
 
         if main_thread_id != current_id:
-            o = type('', (object,), dict(call=(tocall, args, kwargs), res=None))
-            wx.CallAfter(wx_evaluator, o)
-            wx_eval_lock.acquire()
-            return o.res
+            future = Future()
+            with wx_eval_mutex:
+                wx_eval_queue.append((future, (tocall, args, kwargs)))
+                schedule = not wx_eval_scheduled
+                wx_eval_scheduled = True
+            if schedule:
+                wx.CallAfter(wx_evaluator)
+            return future.result()
         else:
             # avoid dead lock if called from main : do job immediately
             return default_evaluator(tocall, *args, **kwargs)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of Beremiz runtime.
+#
+# See COPYING.Runtime file for copyrights details.
+
+# Each power of two range of values is split in 2**SubBucketBits buckets,
+# giving about 6% relative precision with constant memory
+SubBucketBits = 4
+SubBucketCount = 1 << SubBucketBits
+# Values up to 2**MaxBits (i.e. ~1h in microseconds)
+MaxBits = 32
+
+
+class LatencyHistogram(object):
+    """
+    HDR style histogram of durations, recorded as integer microseconds
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * ((MaxBits - SubBucketBits + 1) * SubBucketCount)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @staticmethod
+    def _index(value):
+        if value < SubBucketCount:
+            return value
+        shift = value.bit_length() - SubBucketBits - 1
+        return (shift + 1) * SubBucketCount + (value >> shift) - SubBucketCount
+
+    @staticmethod
+    def _value(index):
+        """ highest value of bucket """
+        if index < SubBucketCount:
+            return index
+        shift = index // SubBucketCount - 1
+        return (((index % SubBucketCount) + SubBucketCount + 1) << shift) - 1
+
+    def record(self, seconds):
+        value = int(seconds * 1000000)
+        index = min(self._index(value), len(self.counts) - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """
+        return value in microseconds under which percent of values are
+        """
+        if self.count == 0:
+            return None
+        target = max(1, percent * self.count / 100.0)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._value(index), self.max)
+        return self.max
+
+    def summary(self):
+        """
+        return count, total, min, max, mean and percentiles, in microseconds
+        """
+        return dict(count=self.count,
+                    total=self.total,
+                    min=self.min,
+                    max=self.max,
+                    mean=self.total / self.count if self.count else None,
+                    p50=self.percentile(50),
+                    p90=self.percentile(90),
+                    p99=self.percentile(99))
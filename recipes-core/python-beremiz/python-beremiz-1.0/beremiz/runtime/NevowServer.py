@@ -39,7 +39,7 @@ from twisted.internet import reactor
 
 import util.paths as paths
 from runtime.loglevels import LogLevels, LogLevelsDict
-from runtime import MainWorker, GetPLCObjectSingleton
+from runtime import MainWorker, GetPLCObjectSingleton, DeferredCall
 
 PAGE_TITLE = 'Beremiz Runtime Web Interface'
 
@@ -230,7 +230,11 @@ class SettingsPage(StyledSettingsPage):
 
     def restartOrRepairPLC(self, action, **kwargs):
         if(action == "Repair"):
-            GetPLCObjectSingleton().RepairPLC()
+            # same as RepairPLC, without blocking reactor while PLC is purged
+            d = DeferredCall(GetPLCObjectSingleton().PurgePLC)
+            d.addCallback(lambda _ignored: MainWorker.finish())
+            d.addErrback(lambda failure: GetPLCObjectSingleton().LogMessage(
+                0, "Repair failed: " + failure.getErrorMessage()))
         else:
             MainWorker.quit()
 
@@ -29,17 +29,31 @@ import sys
 import traceback
 import shutil
 import platform as platform_module
-from time import time
+from time import time, perf_counter, sleep
 import hashlib
+import marshal
+from importlib.util import MAGIC_NUMBER
+from array import array
 from tempfile import mkstemp
+from collections import namedtuple
 from functools import wraps, partial
 import _ctypes
 
 from runtime.typemapping import TypeTranslator
 from runtime.loglevels import LogLevelsDefault, LogLevelsCount
 from runtime.Stunnel import getPSKID
+from runtime.Traces import TraceRingBuffer, DefaultTraceBudget
+from runtime.Traces import TraceEncodings, TraceBroker, TraceSubscriber
+from runtime.Traces import TraceDecimator, TraceTrigger, TriggerConditions
+from runtime.Traces import TraceStatistics, TraceSubscriberCheckPeriod
+from runtime.TraceRecorder import TraceRecorder
+from runtime.PyEval import PyEvalCache, DefaultPyEvalCacheSize
+from runtime.PyEval import PyEvalAsync, PyEvalPendingMarker
+from runtime.PyEval import PyEvalStats, DefaultPyEvalSlowThreshold
+from runtime.PyEval import PyEvalErrorLog, DefaultPyEvalErrorLogPeriod
 from runtime import PlcStatus
 from runtime import MainWorker
+from runtime.Worker import PriorityHigh, PriorityNormal, PriorityLow
 from runtime import default_evaluator
 
 if os.name in ("nt", "ce"):
@@ -50,12 +64,21 @@ elif os.name == "posix":
     dlclose = _ctypes.dlclose
 
 
+OnChangeDesc = namedtuple("OnChangeDesc", ["count", "first", "last"])
+PLCStatusSnapshot = namedtuple("PLCStatusSnapshot", ["status", "log_counts", "generation"])
+
+
 def get_last_traceback(tb):
     while tb.tb_next:
         tb = tb.tb_next
     return tb
 
 
+def format_fbid(FBID):
+    # NULL block pointers come as None from ctypes
+    return "None" if FBID is None else "0x%x" % FBID
+
+
 lib_ext = {
     "linux": ".so",
     "win32":  ".dll",
@@ -68,14 +91,88 @@ def PLCprint(message):
         sys.stdout.flush()
 
 
+def RunInMainPriority(priority):
+    """
+    Same as RunInMain, with job done before queued jobs of lower priority
+    """
+    def decorator(func):
+        @wraps(func)
+        def func_wrapper(*args, **kwargs):
+            return MainWorker.call_priority(priority, func, *args, **kwargs)
+        # lets asynchronous callers submit wrapped func instead (see DeferredCall)
+        func_wrapper.MainWorkerPriority = priority
+        return func_wrapper
+    return decorator
+
+
 def RunInMain(func):
-    @wraps(func)
-    def func_wrapper(*args, **kwargs):
-        return MainWorker.call(func, *args, **kwargs)
-    return func_wrapper
+    return RunInMainPriority(PriorityNormal)(func)
+
+
+class PLClibraryRWLock(object):
+    """
+    Reader/writer lock protecting PLC library from being unloaded while in use.
+    Shared owners (i.e. trace thread blocking in GetDebugData) can call PLC
+    library concurrently, only load/unload needs exclusive ownership.
+    Pending exclusive requests have priority over new shared ones, so that
+    trace thread can't starve StopPLC/NewPLC.
+    acquire/release are exclusive, as with former plain Lock.
+    """
+    def __init__(self):
+        self.cond = Condition(Lock())
+        self.shared = 0
+        self.exclusive = False
+        self.waiting = 0
+
+    def acquire_shared(self):
+        with self.cond:
+            self.cond.wait_for(
+                lambda: not self.exclusive and self.waiting == 0)
+            self.shared += 1
+
+    def release_shared(self):
+        with self.cond:
+            self.shared -= 1
+            if self.shared == 0:
+                self.cond.notify_all()
+
+    def acquire(self):
+        with self.cond:
+            self.waiting += 1
+            self.cond.wait_for(
+                lambda: not self.exclusive and self.shared == 0)
+            self.waiting -= 1
+            self.exclusive = True
+
+    def release(self):
+        with self.cond:
+            self.exclusive = False
+            self.cond.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
 
 
 class PLCObject(object):
+    # Memory budget for trace samples not yet polled.
+    # Can be changed by runtime extensions before PLCObject creation.
+    TraceBudget = DefaultTraceBudget
+    # Count of compiled py_eval expressions kept for reuse.
+    PyEvalCacheSize = DefaultPyEvalCacheSize
+    # Max count of py_eval requests handed over by one PythonIteratorBatch call
+    PyEvalBatchSize = 64
+    # py_eval calls slower than that (in seconds) are logged as slow calls
+    PyEvalSlowThreshold = DefaultPyEvalSlowThreshold
+    # Repeated py_eval exceptions are logged once per period (in seconds)
+    PyEvalErrorLogPeriod = DefaultPyEvalErrorLogPeriod
+    # Period in seconds at which OnChange subscriptions are checked
+    OnChangePollPeriod = 0.1
+    # Period in seconds at which status snapshot is refreshed with log counts
+    StatusSamplerPeriod = 0.5
+
     def __init__(self, WorkingDir, argv, statuschange, evaluator, pyruntimevars):
         self.workingdir = WorkingDir  # must exits already
         self.tmpdir = os.path.join(WorkingDir, 'tmp')
@@ -88,18 +185,33 @@ class PLCObject(object):
         self.pyruntimevars = pyruntimevars
         self.PLCStatus = PlcStatus.Empty
         self.PLClibraryHandle = None
-        self.PLClibraryLock = Lock()
+        self.PLClibraryLock = PLClibraryRWLock()
         # Creates fake C funcs proxies
         self._InitPLCStubCalls()
         self._loading_error = None
         self.python_runtime_vars = None
+        self.PyEvalCache = PyEvalCache(self.PyEvalCacheSize)
+        self.PyEvalAsync = PyEvalAsync()
+        self.PyEvalStats = PyEvalStats(self.PyEvalSlowThreshold)
+        self.PyEvalErrorLog = PyEvalErrorLog(self.PyEvalErrorLogPeriod)
         self.TraceThread = None
         self.TraceLock = Lock()
-        self.Traces = []
+        self.Traces = TraceRingBuffer(self.TraceBudget)
+        self.TraceBroker = TraceBroker(self.Traces)
         self.DebugToken = 0
+        self.TraceRecorder = None
+        self.LastTraceCheck = 0
+        self.TraceUpdatePending = False
 
+        self.BlobsLock = Lock()
         self._init_blobs()
 
+        self.StatusSnapshotLock = Lock()
+        self.StatusSnapshot = PLCStatusSnapshot(self.PLCStatus, (None,) * LogLevelsCount, 0)
+        self.StatusSampler = Thread(target=self.StatusSamplerProc, name="PLCStatusSampler")
+        self.StatusSampler.daemon = True
+        self.StatusSampler.start()
+
     # First task of worker -> no @RunInMain
     def AutoLoad(self, autostart):
         # Get the last transfered PLC
@@ -120,7 +232,32 @@ class PLCObject(object):
 
         self.StatusChange()
 
+    def _RefreshStatusSnapshot(self):
+        """
+        Publish new status snapshot if status or log counts changed.
+        Snapshot is replaced as a whole, so that readers need no lock.
+        """
+        with self.StatusSnapshotLock:
+            self.PLClibraryLock.acquire_shared()
+            try:
+                log_counts = tuple(map(self.GetLogCount, range(LogLevelsCount)))
+            finally:
+                self.PLClibraryLock.release_shared()
+            snapshot = self.StatusSnapshot
+            if snapshot.status != self.PLCStatus or snapshot.log_counts != log_counts:
+                self.StatusSnapshot = PLCStatusSnapshot(
+                    self.PLCStatus, log_counts, snapshot.generation + 1)
+
+    def StatusSamplerProc(self):
+        while True:
+            try:
+                self._RefreshStatusSnapshot()
+            except Exception:
+                PLCprint(traceback.format_exc())
+            sleep(self.StatusSamplerPeriod)
+
     def StatusChange(self):
+        self._RefreshStatusSnapshot()
         if self.statuschange is not None:
             for callee in self.statuschange:
                 callee(self.PLCStatus)
@@ -137,7 +274,7 @@ class PLCObject(object):
             return self._LogMessage(level, bmsg, len(bmsg))
         return None
 
-    @RunInMain
+    @RunInMainPriority(PriorityHigh)
     def ResetLogCount(self):
         if self._ResetLogCount is not None:
             self._ResetLogCount()
@@ -149,7 +286,7 @@ class PLCObject(object):
         elif self._loading_error is not None and level == 0:
             return 1
 
-    @RunInMain
+    @RunInMainPriority(PriorityHigh)
     def GetLogMessage(self, level, msgid):
         tick = ctypes.c_uint32()
         tv_sec = ctypes.c_uint32()
@@ -171,6 +308,44 @@ class PLCObject(object):
     def _GetMD5FileName(self):
         return os.path.join(self.workingdir, "lasttransferedPLC.md5")
 
+    def _GetPyCacheDirName(self):
+        return os.path.join(self.workingdir, "lasttransferedPLC.pycache")
+
+    def _CompileRuntimeFile(self, filename, plc_md5):
+        """
+        Return code object of runtime python file, from cache if source,
+        interpreter and PLC are still the same, compiled and cached otherwise
+        """
+        path = os.path.join(self.workingdir, filename)
+        source = open(path, "rb").read()
+        key = MAGIC_NUMBER + plc_md5.encode() + hashlib.sha1(source).digest()
+        cachepath = os.path.join(self._GetPyCacheDirName(), filename + "c")
+        try:
+            with open(cachepath, "rb") as f:
+                if f.read(len(key)) == key:
+                    return marshal.loads(f.read())
+        except Exception:
+            pass
+        code = compile(source, path, 'exec')
+        tmppath = None
+        try:
+            cachedir = self._GetPyCacheDirName()
+            if not os.path.isdir(cachedir):
+                os.makedirs(cachedir)
+            fd, tmppath = mkstemp(dir=cachedir)
+            with os.fdopen(fd, "wb") as f:
+                f.write(key)
+                marshal.dump(code, f)
+            os.replace(tmppath, cachepath)
+        except Exception:
+            self.LogMessage(1, "Couldn't cache compiled " + filename)
+            if tmppath is not None:
+                try:
+                    os.remove(tmppath)
+                except OSError:
+                    pass
+        return code
+
     def _GetLibFileName(self):
         return os.path.join(self.workingdir, self.CurrentPLCFilename)
 
@@ -201,6 +376,14 @@ class PLCObject(object):
                 self._PythonIterator.restype = ctypes.c_char_p
                 self._PythonIterator.argtypes = [ctypes.c_char_p, ctypes.POINTER(ctypes.c_void_p)]
 
+                # Optional, hands over all py_eval requests pending at once
+                self._PythonIteratorBatch = getattr(self.PLClibraryHandle, "PythonIteratorBatch", None)
+                if self._PythonIteratorBatch is not None:
+                    self._PythonIteratorBatch.restype = ctypes.c_int
+                    self._PythonIteratorBatch.argtypes = [
+                        ctypes.c_int, ctypes.POINTER(ctypes.c_char_p), ctypes.POINTER(ctypes.c_void_p),
+                        ctypes.c_int, ctypes.POINTER(ctypes.c_char_p), ctypes.POINTER(ctypes.c_void_p)]
+
                 self._stopPLC = self._stopPLC_real
             else:
                 # If python confnode is not enabled, we reuse _PythonIterator
@@ -266,7 +449,7 @@ class PLCObject(object):
 
         return True
 
-    @RunInMain
+    @RunInMainPriority(PriorityLow)
     def LoadPLC(self):
         res = self._LoadPLC()
         if res:
@@ -281,8 +464,9 @@ class PLCObject(object):
 
         return res
 
-    @RunInMain
+    @RunInMainPriority(PriorityLow)
     def UnLoadPLC(self):
+        self._StopTraceRecording()
         self.PythonRuntimeCleanup()
         self._FreePLC()
 
@@ -300,6 +484,7 @@ class PLCObject(object):
         self._suspendDebug = lambda x: -1
         self._resumeDebug = lambda: None
         self._PythonIterator = lambda: ""
+        self._PythonIteratorBatch = None
         self._GetLogCount = None
         self._LogMessage = None
         self._GetLogMessage = None
@@ -344,39 +529,174 @@ class PLCObject(object):
     # used internaly
     def PythonRuntimeInit(self):
         MethodNames = ["init", "start", "stop", "cleanup"]
+        self.PyEvalCache.clear()
+        self.PyEvalStats.reset()
         self.python_runtime_vars = globals().copy()
         self.python_runtime_vars.update(self.pyruntimevars)
         parent = self
 
+        class PLCGlobalsAccessors(object):
+            """
+            ctypes accessors of shared globals, resolved once per name.
+            Also gives bulk read and write, apart from PLCGlobals so that
+            they can't shadow globals of the same name.
+            """
+            def __init__(self):
+                # name -> (ctype, safe get, unpack)
+                self.getters = {}
+                # name -> (ctype, safe set, pack)
+                self.setters = {}
+
+            def _resolve(self, cache, name, keys, action):
+                accessor = cache.get(name, None)
+                if accessor is None:
+                    try:
+                        accessor = tuple(parent.python_runtime_vars[key % name]
+                                         for key in keys)
+                    except KeyError:
+                        raise KeyError("Try to %s unknown shared global variable : %s" % (action, name))
+                    cache[name] = accessor
+                return accessor
+
+            def getter(self, name):
+                return self._resolve(self.getters, name, (
+                    "_%s_ctype", "_PySafeGetPLCGlob_%s", "_%s_unpack"), "get")
+
+            def setter(self, name):
+                return self._resolve(self.setters, name, (
+                    "_%s_ctype", "_PySafeSetPLCGlob_%s", "_%s_pack"), "set")
+
+            def reset(self):
+                """
+                forget accessors, and resolve those of declared globals
+                """
+                self.getters.clear()
+                self.setters.clear()
+                prefix = "_PySafeGetPLCGlob_"
+                for key in list(parent.python_runtime_vars):
+                    if key.startswith(prefix):
+                        try:
+                            self.getter(key[len(prefix):])
+                        except KeyError:
+                            pass
+
+            def read(self, names, packed=False):
+                """
+                Get many globals, as a dict,
+                or if packed, as concatenated raw values.
+                Each global is read with its own safe get, so values
+                aren't guaranteed to come from the same PLC cycle.
+                """
+                getters = [self.getter(name) for name in names]
+                values = []
+                # library stays loaded for the whole batch
+                parent.PLClibraryLock.acquire_shared()
+                try:
+                    for t, get, _unpack in getters:
+                        v = t()
+                        get(ctypes.byref(v))
+                        values.append(v)
+                finally:
+                    parent.PLClibraryLock.release_shared()
+                if packed:
+                    return b"".join(bytes(v) for v in values)
+                return {name: getter[2](v) for name, getter, v in zip(names, getters, values)}
+
+            def write(self, mapping):
+                """
+                Set many globals from a {name: value} dict,
+                each one with its own safe set.
+                """
+                values = []
+                for name, value in mapping.items():
+                    t, set_, pack = self.setter(name)
+                    values.append((set_, pack(t, value)))
+                parent.PLClibraryLock.acquire_shared()
+                try:
+                    for set_, v in values:
+                        set_(ctypes.byref(v))
+                finally:
+                    parent.PLClibraryLock.release_shared()
+
+        accessors = PLCGlobalsAccessors()
+
         class PLCSafeGlobals(object):
             def __getattr__(self, name):
-                try:
-                    t = parent.python_runtime_vars["_"+name+"_ctype"]
-                except KeyError:
-                    raise KeyError("Try to get unknown shared global variable : %s" % name)
+                t, get, unpack = accessors.getter(name)
                 v = t()
-                parent.python_runtime_vars["_PySafeGetPLCGlob_"+name](ctypes.byref(v))
-                return parent.python_runtime_vars["_"+name+"_unpack"](v)
+                get(ctypes.byref(v))
+                return unpack(v)
 
             def __setattr__(self, name, value):
-                try:
-                    t = parent.python_runtime_vars["_"+name+"_ctype"]
-                except KeyError:
-                    raise KeyError("Try to set unknown shared global variable : %s" % name)
-                v = parent.python_runtime_vars["_"+name+"_pack"](t, value)
-                parent.python_runtime_vars["_PySafeSetPLCGlob_"+name](ctypes.byref(v))
+                t, set_, pack = accessors.setter(name)
+                set_(ctypes.byref(pack(t, value)))
 
         class OnChangeStateClass(object):
+            def __init__(self):
+                # name -> [last count seen, callbacks]
+                self._subscriptions = {}
+                self._lock = Lock()
+                self._stopping = Event()
+                self._thread = None
+
             def __getattr__(self, name):
                 u = parent.python_runtime_vars["_"+name+"_unpack"]
-                return type("changedesc",(),dict(
-                    count = parent.python_runtime_vars["_PyOnChangeCount_"+name].value,
-                    first = u(parent.python_runtime_vars["_PyOnChangeFirst_"+name]),
-                    last = u(parent.python_runtime_vars["_PyOnChangeLast_"+name])))
+                return OnChangeDesc(
+                    parent.python_runtime_vars["_PyOnChangeCount_"+name].value,
+                    u(parent.python_runtime_vars["_PyOnChangeFirst_"+name]),
+                    u(parent.python_runtime_vars["_PyOnChangeLast_"+name]))
+
+            def subscribe(self, name, fn):
+                """
+                Call fn(name, desc) from dispatcher thread when name changed.
+                Changes happening between two checks are reported once.
+                """
+                count = parent.python_runtime_vars["_PyOnChangeCount_"+name].value
+                with self._lock:
+                    self._subscriptions.setdefault(name, [count, []])[1].append(fn)
+                    if self._thread is None:
+                        self._stopping.clear()
+                        self._thread = Thread(target=self._dispatch, name="PLCOnChangeDispatcher")
+                        self._thread.start()
+
+            def unsubscribe(self, name, fn):
+                with self._lock:
+                    subscription = self._subscriptions.get(name, None)
+                    if subscription is not None and fn in subscription[1]:
+                        subscription[1].remove(fn)
+                        if not subscription[1]:
+                            self._subscriptions.pop(name)
+
+            def _dispatch(self):
+                while not self._stopping.wait(parent.OnChangePollPeriod):
+                    changed = []
+                    with self._lock:
+                        for name, subscription in self._subscriptions.items():
+                            count = parent.python_runtime_vars["_PyOnChangeCount_"+name].value
+                            if count != subscription[0]:
+                                subscription[0] = count
+                                changed.append((name, list(subscription[1])))
+                    for name, callbacks in changed:
+                        desc = getattr(self, name)
+                        for fn in callbacks:
+                            try:
+                                fn(name, desc)
+                            except Exception:
+                                parent.LogMessage(0, "OnChange callback of %s failed:\n%s" % (
+                                    name, traceback.format_exc()))
+
+            def _stop(self):
+                with self._lock:
+                    thread, self._thread = self._thread, None
+                    self._subscriptions.clear()
+                if thread is not None:
+                    self._stopping.set()
+                    thread.join()
 
 
         self.python_runtime_vars.update({
             "PLCGlobals":     PLCSafeGlobals(),
+            "PLCGlobalsBulk": accessors,
             "OnChange":       OnChangeStateClass(),
             "WorkingDir":     self.workingdir,
             "PLCObject":      self,
@@ -386,13 +706,18 @@ class PLCObject(object):
         for methodname in MethodNames:
             self.python_runtime_vars["_runtime_%s" % methodname] = []
 
+        try:
+            plc_md5 = open(self._GetMD5FileName(), "r").read().strip()
+        except Exception:
+            plc_md5 = ""
+
         try:
             filenames = os.listdir(self.workingdir)
             filenames.sort()
             for filename in filenames:
                 name, ext = os.path.splitext(filename)
                 if name.upper().startswith("RUNTIME") and ext.upper() == ".PY":
-                    exec(compile(open(os.path.join(self.workingdir, filename), "rb").read(), os.path.join(self.workingdir, filename), 'exec'), self.python_runtime_vars)
+                    exec(self._CompileRuntimeFile(filename, plc_md5), self.python_runtime_vars)
                     for methodname in MethodNames:
                         method = self.python_runtime_vars.get("_%s_%s" % (name, methodname), None)
                         if method is not None:
@@ -401,6 +726,9 @@ class PLCObject(object):
             self.LogMessage(0, traceback.format_exc())
             raise
 
+        # accessors of globals declared by runtime files
+        accessors.reset()
+
         self.PythonRuntimeCall("init", use_evaluator=False)
 
         self.PythonThreadCondLock = Lock()
@@ -417,35 +745,110 @@ class PLCObject(object):
             self.PythonThreadCommand("Finish")
             self.PythonThread.join()
             self.PythonRuntimeCall("cleanup", use_evaluator=False, reverse_order=True)
+            self.python_runtime_vars["OnChange"]._stop()
 
+        self.PyEvalAsync.stop()
         self.python_runtime_vars = None
 
+    def _PyEvalException(self, FBID, cmd, e, full=False):
+        """
+        Log py_eval exception in full the first time, and then
+        periodically as count of repeats. Return result string for PLC.
+        """
+        # innermost frame location, without reading source lines
+        if e.__traceback__ is not None:
+            tb = get_last_traceback(e.__traceback__)
+            line = (tb.tb_frame.f_code.co_filename, tb.tb_lineno)
+        else:
+            line = getattr(e, "lineno", None)
+        repeats = self.PyEvalErrorLog.report((FBID, type(e), line), e)
+        if repeats == 0:
+            if full:
+                details = '\n'.join(traceback.format_exception(type(e), e, e.__traceback__))
+            else:
+                details = str(e)
+            self.LogMessage(1, ('PyEval@%s(Code="%s") Exception "%s"') % (
+                format_fbid(FBID), cmd, details))
+        elif repeats is not None:
+            self.LogMessage(1, ('PyEval@%s(Code="%s") Exception "%s" repeated %d times') % (
+                format_fbid(FBID), cmd, str(e), repeats))
+        return "#EXCEPTION : "+str(e)
+
+    def _PyEval(self, FBID, cmd):
+        """
+        Evaluate one py_eval request, return result as string.
+        Coroutines and futures are awaited in background, PyEvalPendingMarker
+        is returned until their result is given back to next request of the
+        same block.
+        """
+        pending = self.PyEvalAsync.collect(FBID)
+        if pending is not None:
+            done, result, e = pending
+            if not done:
+                return PyEvalPendingMarker
+            if e is not None:
+                return self._PyEvalException(FBID, cmd, e)
+            return str(result)
+        try:
+            self.python_runtime_vars["FBID"] = FBID
+            t0 = perf_counter()
+            AST = self.PyEvalCache.get(cmd)
+            t1 = perf_counter()
+            result, exp = self.evaluator(eval, AST, self.python_runtime_vars)
+            t2 = perf_counter()
+            if exp is not None:
+                res = self._PyEvalException(FBID, cmd, exp[1], full=True)
+            elif self.PyEvalAsync.awaitable(result):
+                self.PyEvalAsync.submit(FBID, result)
+                res = PyEvalPendingMarker
+            else:
+                res = str(result)
+            self.PyEvalStats.record(FBID, cmd, (t1 - t0, t2 - t1, perf_counter() - t2))
+            self.python_runtime_vars["FBID"] = None
+        except Exception as e:
+            res = self._PyEvalException(FBID, cmd, e)
+        return res
+
     def PythonThreadLoop(self):
-        res, cmd, blkid = "None", "None", ctypes.c_void_p()
-        compile_cache = {}
+        if self._PythonIteratorBatch is not None:
+            self.PythonThreadBatchLoop()
+        else:
+            res, cmd, blkid = "None", "None", ctypes.c_void_p()
+            while True:
+                cmd = self._PythonIterator(res.encode(), blkid)
+                FBID = blkid.value
+                if cmd is None:
+                    break
+                res = self._PyEval(FBID, cmd.decode())
+        # results still awaited are not delivered after PLC restart
+        self.PyEvalAsync.cancel()
+        for (FBID, _exc_type, _line), repeats, e in self.PyEvalErrorLog.flush():
+            self.LogMessage(1, ('PyEval@%s Exception "%s" repeated %d times') % (
+                format_fbid(FBID), str(e), repeats))
+
+    def PythonThreadBatchLoop(self):
+        """
+        Same as PythonThreadLoop, but with one PythonIteratorBatch call
+        per batch of requests instead of one PythonIterator call per request.
+        PythonIteratorBatch(count, results, ids, maxcount, cmds, blkids)
+        gives back count results of blocks ids, then waits for requests,
+        and fill up to maxcount cmds and blkids. It returns count of requests,
+        or -1 once PLC is stopping.
+        """
+        size = self.PyEvalBatchSize
+        results = (ctypes.c_char_p * size)()
+        ids = (ctypes.c_void_p * size)()
+        cmds = (ctypes.c_char_p * size)()
+        blkids = (ctypes.c_void_p * size)()
+        count = 0
         while True:
-            cmd = self._PythonIterator(res.encode(), blkid)
-            FBID = blkid.value
-            if cmd is None:
+            count = self._PythonIteratorBatch(count, results, ids, size, cmds, blkids)
+            if count < 0:
                 break
-            cmd = cmd.decode()
-            try:
-                self.python_runtime_vars["FBID"] = FBID
-                ccmd, AST = compile_cache.get(FBID, (None, None))
-                if ccmd is None or ccmd != cmd:
-                    AST = compile(cmd, '<plc>', 'eval')
-                    compile_cache[FBID] = (cmd, AST)
-                result, exp = self.evaluator(eval, AST, self.python_runtime_vars)
-                if exp is not None:
-                    res = "#EXCEPTION : "+str(exp[1])
-                    self.LogMessage(1, ('PyEval@0x%x(Code="%s") Exception "%s"') % (
-                        FBID, cmd, '\n'.join(traceback.format_exception(*exp))))
-                else:
-                    res = str(result)
-                self.python_runtime_vars["FBID"] = None
-            except Exception as e:
-                res = "#EXCEPTION : "+str(e)
-                self.LogMessage(1, ('PyEval@0x%x(Code="%s") Exception "%s"') % (FBID, cmd, str(e)))
+            for i in range(count):
+                FBID = blkids[i]
+                ids[i] = FBID
+                results[i] = self._PyEval(FBID, cmds[i].decode()).encode()
 
     def PythonThreadProc(self):
         while True:
@@ -536,6 +939,8 @@ class PLCObject(object):
                 self.LogMessage("PLC started")
                 self.PLCStatus = PlcStatus.Started
                 self.StatusChange()
+                if self.TraceRecorder is not None:
+                    self._StartTraceThread()
                 self.PythonThreadCommand("Start")
             else:
                 self._fail(_("Problem starting PLC : error %d" % res))
@@ -550,41 +955,57 @@ class PLCObject(object):
             if self.TraceThread is not None:
                 self.TraceThread.join()
                 self.TraceThread = None
+            if self.TraceRecorder is not None:
+                self.TraceRecorder.recorder.flush()
             return True
         return False
 
     def GetPLCstatus(self):
-        try:
-            return self._GetPLCstatus()
-        except EOFError:
+        """
+        Return status and log counts from last status snapshot,
+        without waiting for main thread
+        """
+        if not MainWorker.enabled:
             return (PlcStatus.Disconnected, None)
+        snapshot = self.StatusSnapshot
+        return snapshot.status, list(snapshot.log_counts)
 
-    @RunInMain
-    def _GetPLCstatus(self):
-        return self.PLCStatus, list(map(self.GetLogCount, range(LogLevelsCount)))
+    def GetPLCstatusSnapshot(self):
+        """
+        Same as GetPLCstatus, with generation number
+        that changes whenever status or log counts change
+        """
+        if not MainWorker.enabled:
+            return (PlcStatus.Disconnected, None, None)
+        snapshot = self.StatusSnapshot
+        return snapshot.status, list(snapshot.log_counts), snapshot.generation
 
-    @RunInMain
+    @RunInMainPriority(PriorityHigh)
     def GetPLCID(self):
         return getPSKID(partial(self.LogMessage, 0))
 
     def _init_blobs(self):
         self.blobs = {}
+        # uploadID -> (fd, path, size) of blobs being uploaded by offset
+        self.uploads = {}
         if os.path.exists(self.tmpdir):
             shutil.rmtree(self.tmpdir)
         os.mkdir(self.tmpdir)
 
-    @RunInMain
+    @RunInMainPriority(PriorityLow)
     def SeedBlob(self, seed):
         blob = (mkstemp(dir=self.tmpdir) + (hashlib.new('md5'),))
         _fd, _path, md5sum = blob
         md5sum.update(seed)
         newBlobID = md5sum.digest()
-        self.blobs[newBlobID] = blob
+        with self.BlobsLock:
+            self.blobs[newBlobID] = blob
         return newBlobID
 
-    @RunInMain
+    @RunInMainPriority(PriorityLow)
     def AppendChunkToBlob(self, data, blobID):
-        blob = self.blobs.pop(blobID, None)
+        with self.BlobsLock:
+            blob = self.blobs.pop(blobID, None)
 
         if blob is None:
             return None
@@ -593,17 +1014,103 @@ class PLCObject(object):
         md5sum.update(data)
         newBlobID = md5sum.digest()
         os.write(fd, data)
-        self.blobs[newBlobID] = blob
+        with self.BlobsLock:
+            self.blobs[newBlobID] = blob
         return newBlobID
 
+    def CreateBlob(self, size):
+        """
+        Start upload of a blob of given size, whose chunks can then be
+        written in any order and concurrently with WriteBlobChunk.
+        Doesn't need main thread. Returns uploadID.
+        """
+        if size < 0:
+            raise ValueError("Invalid blob size : %d" % size)
+        fd, path = mkstemp(dir=self.tmpdir)
+        try:
+            os.ftruncate(fd, size)
+        except OSError:
+            os.close(fd)
+            os.remove(path)
+            raise
+        uploadID = os.urandom(16)
+        with self.BlobsLock:
+            self.uploads[uploadID] = (fd, path, size)
+        return uploadID
+
+    def WriteBlobChunk(self, uploadID, offset, data):
+        """
+        Write chunk of data at given offset of blob being uploaded
+        """
+        with self.BlobsLock:
+            upload = self.uploads.get(uploadID, None)
+            if upload is None:
+                return False
+            fd, _path, size = upload
+            if offset < 0 or offset + len(data) > size:
+                return False
+            # own descriptor, in case upload is finalized or purged meanwhile
+            fd = os.dup(fd)
+        try:
+            data = memoryview(data)
+            while data:
+                written = os.pwrite(fd, data, offset)
+                if not written:
+                    raise OSError("Short write of blob chunk")
+                data = data[written:]
+                offset += written
+        finally:
+            os.close(fd)
+        return True
+
+    def FinalizeBlob(self, uploadID, md5sum):
+        """
+        Check md5 digest of whole uploaded blob, and make it
+        available to NewPLC. Returns blobID, that is md5 digest of blob
+        as for SeedBlob(b"") and AppendChunkToBlob, or None if upload failed
+        """
+        with self.BlobsLock:
+            upload = self.uploads.pop(uploadID, None)
+        if upload is None:
+            return None
+        fd, path, size = upload
+        digest = hashlib.new('md5')
+        offset = 0
+        while offset < size:
+            chunk = os.pread(fd, min(1 << 20, size - offset), offset)
+            if not chunk:
+                break
+            digest.update(chunk)
+            offset += len(chunk)
+        if digest.digest() != md5sum:
+            os.close(fd)
+            os.remove(path)
+            self.LogMessage("Uploaded blob has wrong md5 digest")
+            return None
+        os.lseek(fd, size, os.SEEK_SET)
+        blobID = digest.digest()
+        with self.BlobsLock:
+            duplicate = blobID in self.blobs
+            if not duplicate:
+                self.blobs[blobID] = (fd, path, digest)
+        if duplicate:
+            # same content already available with that blobID
+            os.close(fd)
+            os.remove(path)
+        return blobID
+
     @RunInMain
     def PurgeBlobs(self):
-        for fd, _path, _md5sum in list(self.blobs.values()):
-            os.close(fd)
-        self._init_blobs()
+        with self.BlobsLock:
+            for fd, _path, _md5sum in list(self.blobs.values()):
+                os.close(fd)
+            for fd, _path, _size in list(self.uploads.values()):
+                os.close(fd)
+            self._init_blobs()
 
     def BlobAsFile(self, blobID, newpath):
-        blob = self.blobs.pop(blobID, None)
+        with self.BlobsLock:
+            blob = self.blobs.pop(blobID, None)
 
         if blob is None:
             raise Exception(
@@ -626,7 +1133,7 @@ class PLCObject(object):
         self.PurgePLC()
         MainWorker.finish()
 
-    @RunInMain
+    @RunInMainPriority(PriorityLow)
     def PurgePLC(self):
 
         extra_files_log = self._extra_files_log_path()
@@ -650,11 +1157,14 @@ class PLCObject(object):
                 except Exception:
                     self.LogMessage("Couldn't purge " + filename)
 
+        # compiled runtime files of previous PLC
+        shutil.rmtree(self._GetPyCacheDirName(), ignore_errors=True)
+
         self.PLCStatus = PlcStatus.Empty
 
         # TODO: PLCObject restart
 
-    @RunInMain
+    @RunInMainPriority(PriorityLow)
     def NewPLC(self, md5sum, plc_object, extrafiles):
         if self.PLCStatus in [PlcStatus.Stopped, PlcStatus.Empty, PlcStatus.Broken]:
             NewFileName = md5sum + lib_ext
@@ -711,52 +1221,427 @@ class PLCObject(object):
         return False
 
     @RunInMain
-    def SetTraceVariablesList(self, idxs):
+    def SetTraceVariablesList(self, idxs, encoding="raw", decimation=None,
+                              statistics=False, DebugToken=None):
         """
         Call ctype imported function to append
         these indexes to registred variables in PLC debugger
+        encoding selects format of samples returned by GetTraceVariables
+        (see TraceEncodings), runtimes not supporting it raise an exception
+        decimation, if given, is the size in ticks of buckets aggregated
+        for GetTraceDecimated
+        statistics enables running statistics for GetTraceStatistics
+        Several clients can trace simultaneously, each one getting its own
+        DebugToken. PLC debugger traces union of their variables.
+        DebugToken, if given, is client's previous DebugToken, whose
+        variables are dropped right away instead of when it times out.
+        Empty idxs ends client's tracing, that is newest client's one
+        when DebugToken isn't given.
         """
-        self.DebugToken += 1
+        if encoding not in TraceEncodings:
+            raise ValueError("Unsupported trace encoding : %s" % encoding)
+        self.TraceLock.acquire()
+        if DebugToken is not None:
+            previous = self.TraceBroker.subscribers.get(DebugToken, None)
+        elif not idxs:
+            clients = [sub for sub in self.TraceBroker.subscribers.values()
+                       if not sub.persistent]
+            previous = max(clients, key=lambda sub: sub.token) \
+                if clients else None
+        else:
+            previous = None
+        if previous is not None and not previous.persistent:
+            self.TraceBroker.unsubscribe(previous)
+        self.TraceLock.release()
         if idxs:
-            # suspend but dont disable
-            if self._suspendDebug(False) == 0:
-                # keep a copy of requested idx
-                self._ResetDebugVariables()
-                for idx, iectype, force in idxs:
-                    if force is not None:
-                        c_type, _unpack_func, pack_func = \
-                            TypeTranslator.get(iectype,
-                                               (None, None, None))
-                        force = ctypes.byref(pack_func(c_type, force))
-                    res = self._RegisterDebugVariable(idx, force)
-                    if res != 0:
-                        self._resumeDebug()
-                        self._suspendDebug(True)
-                        return -res
-                self._TracesSwap()
+            self.DebugToken += 1
+            sub = TraceSubscriber(self.DebugToken, idxs, encoding)
+            if decimation:
+                sub.decimator = TraceDecimator(decimation)
+                sub.consumers.append(sub.decimator)
+            if statistics:
+                sub.statistics = TraceStatistics(len(sub.idxs))
+                sub.consumers.append(sub.statistics)
+            return self._TraceSubscribe(sub)
+        self._UpdateTraceVariables()
+        return 4 # DEBUG_SUSPENDED
+
+    def _UpdateTraceVariables(self):
+        """
+        Forget subscribers that timed out, and register union of variables
+        of remaining ones, or disable debugger if none is left.
+        Must be called from main thread.
+        """
+        self.TraceLock.acquire()
+        self.TraceUpdatePending = False
+        self.TraceBroker.prune()
+        subscribers = self.TraceBroker.live_subscribers()
+        forcing = self.TraceBroker.forcing
+        self.TraceLock.release()
+        if subscribers:
+            registered = self.TraceBroker.union(subscribers, forcing)
+            if registered == self.TraceBroker.registered:
+                return
+            res = self._RegisterTraceVariables(registered)
+            if res is None:
+                return
+            if res == 0:
+                self.TraceLock.acquire()
+                self.TraceBroker.update(registered, forcing)
+                self.TraceLock.release()
                 self._resumeDebug()
-                return self.DebugToken
+                return
+            # debugger was disabled by _RegisterTraceVariables
         else:
             self._suspendDebug(True)
-        return 4 # DEBUG_SUSPENDED
+        self.TraceLock.acquire()
+        self.TraceBroker.clear()
+        self.TraceLock.release()
 
-    def _TracesSwap(self):
+    def _CheckTraceSubscribers(self):
+        """
+        Have main thread update registered variables once some subscribers
+        timed out. Doesn't need main thread.
+        """
+        now = time()
+        if now - self.LastTraceCheck < TraceSubscriberCheckPeriod:
+            return
+        self.LastTraceCheck = now
+        self.TraceLock.acquire()
+        update = self.TraceBroker.expired() and not self.TraceUpdatePending
+        if update:
+            self.TraceUpdatePending = True
+        self.TraceLock.release()
+        if update:
+            future = MainWorker.submit(self._UpdateTraceVariables)
+            if future.done() and future.exception() is not None:
+                # i.e. worker queue is full, retry on next check
+                self.TraceUpdatePending = False
+
+    def _TraceSubscribe(self, sub):
+        """
+        Add trace subscriber, registering variables in PLC debugger if
+        needed. Return subscriber's DebugToken, or error code.
+        """
+        self.TraceLock.acquire()
+        self.TraceBroker.prune()
+        subscribers = self.TraceBroker.live_subscribers()
+        self.TraceLock.release()
+        registered = self.TraceBroker.union(subscribers + [sub], sub.token)
+        changed = registered != self.TraceBroker.registered
+        if changed:
+            res = self._RegisterTraceVariables(registered)
+            if res is None:
+                return 4 # DEBUG_SUSPENDED
+            if res != 0:
+                # restore variables of other clients, if any
+                previous = self.TraceBroker.registered
+                if previous and self._RegisterTraceVariables(previous) == 0:
+                    self._resumeDebug()
+                else:
+                    self._suspendDebug(True)
+                    self.TraceLock.acquire()
+                    self.TraceBroker.clear()
+                    self.TraceLock.release()
+                return -res
+        self.TraceLock.acquire()
+        self.TraceBroker.subscribe(sub, registered)
+        self.TraceLock.release()
+        if changed:
+            # debugger was suspended by _RegisterTraceVariables
+            self._resumeDebug()
+        self._StartTraceThread()
+        return sub.token
+
+    def _RegisterTraceVariables(self, idxs):
+        """
+        Register variables in PLC debugger, return 0 or error code,
+        or None if debugger isn't available.
+        On success, debugger is left suspended until _resumeDebug.
+        """
+        # suspend but dont disable
+        if self._suspendDebug(False) != 0:
+            return None
+        self._ResetDebugVariables()
+        for idx, iectype, force in idxs:
+            if force is not None:
+                c_type, _unpack_func, pack_func = \
+                    TypeTranslator.get(iectype,
+                                       (None, None, None))
+                force = ctypes.byref(pack_func(c_type, force))
+            res = self._RegisterDebugVariable(idx, force)
+            if res != 0:
+                self._resumeDebug()
+                self._suspendDebug(True)
+                return res
+        return 0
+
+    def _StartTraceThread(self):
         self.LastSwapTrace = time()
+        self.TraceLock.acquire()
         if self.TraceThread is None and self.PLCStatus == PlcStatus.Started:
             self.TraceThread = Thread(target=self.TraceThreadProc, name="PLCTrace")
             self.TraceThread.start()
+        self.TraceLock.release()
+        self._CheckTraceSubscribers()
+
+    def _TracesSwap(self, sub):
+        self._StartTraceThread()
         self.TraceLock.acquire()
-        Traces = self.Traces
-        self.Traces = []
+        Traces = self.TraceBroker.read(sub)
         self.TraceLock.release()
         return Traces
 
+    def _GetTraceSubscriber(self, DebugToken):
+        self.TraceLock.acquire()
+        sub = self.TraceBroker.subscribers.get(DebugToken, None)
+        self.TraceLock.release()
+        return sub
+
     @RunInMain
+    def SubscribeTraces(self, idxs):
+        """
+        Trace given variables for an in-process consumer (i.e. WAMP trace
+        streams). Return TraceSubscriber to be given to ReadTraces, or None
+        if variables couldn't be registered.
+        """
+        if not idxs:
+            return None
+        self.DebugToken += 1
+        sub = TraceSubscriber(self.DebugToken, idxs, "raw")
+        if self._TraceSubscribe(sub) != sub.token:
+            return None
+        return sub
+
+    def ReadTraces(self, sub):
+        """
+        Return (tick, bytes) samples not yet read by subscriber given by
+        SubscribeTraces, or None once it was dropped. Doesn't need main
+        worker.
+        """
+        self._StartTraceThread()
+        self.TraceLock.acquire()
+        if self.TraceBroker.subscribers.get(sub.token, None) is sub:
+            Traces = self.TraceBroker.read(sub)
+        else:
+            Traces = None
+        self.TraceLock.release()
+        return Traces
+
     def GetTraceVariables(self, DebugToken):
-        if DebugToken is not None and DebugToken == self.DebugToken:
-            return self.PLCStatus, self._TracesSwap()
+        """
+        Return samples not yet read by DebugToken, encoded as requested
+        to SetTraceVariablesList. Doesn't need main worker, samples are
+        encoded out of TraceLock.
+        """
+        sub = self._GetTraceSubscriber(DebugToken)
+        if sub is not None:
+            if sub.encoder is None:
+                return self.PLCStatus, self._TracesSwap(sub)
+            # delta encoding needs samples of concurrent polls in order
+            with sub.encoder.lock:
+                Traces = sub.encoder.encode(self._TracesSwap(sub))
+            return self.PLCStatus, Traces
         return PlcStatus.Broken, []
 
+    def GetTraceVariablesColumnar(self, DebugToken):
+        """
+        Same as GetTraceVariables, but samples are decoded and returned
+        as contiguous arrays : packed uint32 ticks, and one (typecode, data)
+        column per registered variable, see DebugBufferDecoder.columns.
+        If samples don't match registered types, ticks are None and
+        raw samples are given as in GetTraceVariables, so none is lost.
+        Doesn't need main worker, samples are decoded out of TraceLock.
+        """
+        sub = self._GetTraceSubscriber(DebugToken)
+        if sub is not None:
+            Traces = self._TracesSwap(sub)
+            columns = sub.decoder.columns(
+                [buff for _tick, buff in Traces])
+            if columns is None:
+                return self.PLCStatus, None, Traces
+            ticks = array("I", [tick for tick, _buff in Traces])
+            return self.PLCStatus, ticks.tobytes(), columns
+        return PlcStatus.Broken, b"", []
+
+    def GetTraceDecimated(self, DebugToken, start_tick, end_tick, points):
+        """
+        Return at most points min/max/first/last aggregates of traced
+        variables between start_tick and end_tick, as a list of
+        (first tick, [(min, max, first, last) or None for each variable]).
+        Trace must have been set with decimation. Raw samples of that
+        DebugToken are discarded. Doesn't need main worker.
+        """
+        sub = self._GetTraceSubscriber(DebugToken)
+        if sub is not None and sub.decimator is not None:
+            self._StartTraceThread()
+            self.TraceLock.acquire()
+            self.TraceBroker.skip(sub)
+            res = sub.decimator.get(start_tick, end_tick, points)
+            self.TraceLock.release()
+            return self.PLCStatus, res
+        return PlcStatus.Broken, []
+
+    @RunInMain
+    def StartTraceRecording(self, idxs, **options):
+        """
+        Record given variables on disk, whether clients are connected or
+        not, see TraceRecorder for options. Recording of the same variables
+        is appended to previous one. Return DebugToken or error code.
+        """
+        self._StopTraceRecording()
+        self.DebugToken += 1
+        sub = TraceSubscriber(self.DebugToken, idxs, "raw", persistent=True)
+        res = self._TraceSubscribe(sub)
+        if res != sub.token:
+            return res
+        # previous recording is only discarded once variables are registered
+        try:
+            sub.recorder = TraceRecorder(
+                os.path.join(self.workingdir, "traces"), idxs, **options)
+        except Exception:
+            self.TraceLock.acquire()
+            self.TraceBroker.unsubscribe(sub)
+            self.TraceLock.release()
+            raise
+        self.TraceRecorder = sub
+        return res
+
+    @RunInMain
+    def StopTraceRecording(self):
+        self._StopTraceRecording()
+
+    def _StopTraceRecording(self):
+        sub = self.TraceRecorder
+        if sub is not None:
+            self.TraceRecorder = None
+            self.TraceLock.acquire()
+            self.TraceBroker.unsubscribe(sub)
+            self.TraceLock.release()
+            sub.recorder.close()
+
+    @RunInMain
+    def GetTraceHistory(self, start_time, end_time, max_samples=100000):
+        """
+        Return recorded variables as (idx, iectype) list, and
+        (tick, time, data) samples recorded between start and end time
+        """
+        if self.TraceRecorder is None:
+            return [], []
+        recorder = self.TraceRecorder.recorder
+        return recorder.idxs, recorder.read(start_time, end_time, max_samples)
+
+    def GetTraceStatistics(self, DebugToken, reset=False):
+        """
+        Return (count, min, max, mean, stddev, last) of each variable traced
+        by DebugToken since last reset. Trace must have been set with
+        statistics. Raw samples of that DebugToken are discarded.
+        """
+        sub = self._GetTraceSubscriber(DebugToken)
+        if sub is None or sub.statistics is None:
+            return PlcStatus.Broken, []
+        self._StartTraceThread()
+        self.TraceLock.acquire()
+        self.TraceBroker.skip(sub)
+        res = sub.statistics.get()
+        if reset:
+            sub.statistics.reset()
+        self.TraceLock.release()
+        return self.PLCStatus, res
+
+    @RunInMain
+    def SetTraceTrigger(self, DebugToken, position, condition,
+                        threshold=0, pre=100, post=100):
+        """
+        Arm a triggered capture on variable at given position in DebugToken's
+        variables list. condition is one of TriggerConditions, evaluated
+        against threshold. pre and post are counts of samples kept before
+        and after trigger. Previous trigger of that DebugToken is replaced.
+        """
+        if condition not in TriggerConditions:
+            raise ValueError("Unsupported trigger condition : %s" % condition)
+        sub = self._GetTraceSubscriber(DebugToken)
+        if sub is None or not 0 <= position < len(sub.idxs):
+            return False
+        trigger = TraceTrigger(position, condition, threshold, pre, post)
+        self.TraceLock.acquire()
+        if sub.trigger is not None:
+            sub.consumers.remove(sub.trigger)
+        sub.trigger = trigger
+        sub.consumers.append(trigger)
+        self.TraceLock.release()
+        self._StartTraceThread()
+        return True
+
+    def GetTraceTrigger(self, DebugToken, rearm=False):
+        """
+        Return trigger state ("armed", "triggered" or "done"), tick of
+        trigger and captured (tick, bytes) samples once done.
+        rearm restarts capture once done. Raw samples of that
+        DebugToken are discarded. Doesn't need main worker.
+        """
+        sub = self._GetTraceSubscriber(DebugToken)
+        if sub is None or sub.trigger is None:
+            return PlcStatus.Broken, None, None, []
+        self._StartTraceThread()
+        self.TraceLock.acquire()
+        self.TraceBroker.skip(sub)
+        trigger = sub.trigger
+        state, tick = trigger.state, trigger.trigger_tick
+        capture = trigger.capture if state == "done" else []
+        if rearm and state == "done":
+            trigger.rearm()
+        self.TraceLock.release()
+        return self.PLCStatus, state, tick, capture
+
+    def GetTraceBufferStats(self, DebugToken=None):
+        """
+        Return trace buffer memory budget and usage, count of samples
+        dropped, count of trace clients, and if DebugToken is given,
+        count of samples that client didn't get
+        """
+        self.TraceLock.acquire()
+        stats = self.Traces.stats()
+        stats["subscribers"] = len(self.TraceBroker.live_subscribers())
+        sub = self.TraceBroker.subscribers.get(DebugToken, None)
+        if sub is not None:
+            stats["subscriber_dropped"] = sub.dropped
+        self.TraceLock.release()
+        if self.TraceRecorder is not None:
+            stats["recorder"] = self.TraceRecorder.recorder.stats()
+        return stats
+
+    def GetWorkerStatus(self, reset=False, trace_interleave=None):
+        """
+        Return count of calls waiting for main thread, queue wait and run
+        time histograms of calls, and recent slow calls.
+        trace_interleave, if given, enables or disables tracing of delay
+        between waker call and job start, in interleave mode
+        """
+        status = MainWorker.status()
+        if reset:
+            MainWorker.stats.reset()
+        if trace_interleave is not None:
+            MainWorker.stats.trace_interleave = bool(trace_interleave)
+        return status
+
+    def GetPyEvalStats(self, top=10):
+        """
+        Return compile, eval and encode latencies (in microseconds) of the
+        top py_eval blocks spending most time, recent slow calls as
+        (time, FBID, code, duration in seconds), and compiled code cache stats
+        """
+        stats = self.PyEvalStats.get(top)
+        stats["cache"] = self.PyEvalCache.stats()
+        return stats
+
+    def GetPyEvalCacheStats(self):
+        """
+        Return size, entries count, hits, misses and evictions
+        of py_eval compiled expressions cache
+        """
+        return self.PyEvalCache.stats()
+
     def TraceThreadProc(self):
         """
         Return a list of traces, corresponding to the list of required idx
@@ -766,37 +1651,45 @@ class PLCObject(object):
             tick = ctypes.c_uint32()
             size = ctypes.c_uint32()
             buff = ctypes.c_void_p()
-            TraceBuffer = None
 
-            self.PLClibraryLock.acquire()
+            # GetDebugData blocks until next PLC cycle,
+            # library only needs to be kept loaded meanwhile
+            self.PLClibraryLock.acquire_shared()
 
             res = self._GetDebugData(ctypes.byref(tick),
                                      ctypes.byref(size),
                                      ctypes.byref(buff))
+            recorded = None
             if res == 0:
                 if size.value:
-                    TraceBuffer = ctypes.string_at(buff.value, size.value)
+                    # copy debug data straight into trace ring buffer
+                    self.TraceLock.acquire()
+                    sample = self.Traces.append_from_address(
+                        tick.value, buff.value, size.value)
+                    self.TraceBroker.feed(tick.value, sample)
+                    recorder = self.TraceRecorder
+                    if recorder is not None:
+                        recorded = self.TraceBroker.read(recorder)
+                    self.TraceLock.release()
                 self._FreeDebugData()
 
-            self.PLClibraryLock.release()
+            self.PLClibraryLock.release_shared()
+
+            # recorded samples are copies, queued once PLC debug data is freed
+            if recorded:
+                recorder.recorder.append(recorded)
 
             # leave thread if GetDebugData isn't happy.
             if res != 0:
                 break
 
-            if TraceBuffer is not None:
-                self.TraceLock.acquire()
-                lT = len(self.Traces)
-                if lT != 0 and lT * len(self.Traces[0]) > 1024 * 1024:
-                    self.Traces.pop(0)
-                self.Traces.append((tick.value, TraceBuffer))
-                self.TraceLock.release()
+            self._CheckTraceSubscribers()
 
             # TraceProc stops here if Traces not polled for 3 seconds
             traces_age = time() - self.LastSwapTrace
-            if traces_age > 3:
+            if traces_age > 3 and self.TraceRecorder is None:
                 self.TraceLock.acquire()
-                self.Traces = []
+                self.Traces.clear(dropped=True)
                 self.TraceLock.release()
                 self._suspendDebug(True)  # Disable debugger
                 break
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of Beremiz runtime.
+#
+# See COPYING.Runtime file for copyrights details.
+
+import asyncio
+import inspect
+from concurrent.futures import Future, CancelledError, InvalidStateError
+from collections import OrderedDict, deque
+from threading import Thread, Lock
+from time import time
+
+from runtime.Histogram import LatencyHistogram
+
+DefaultPyEvalCacheSize = 256
+# py_eval calls slower than that many seconds are logged in slow calls ring
+DefaultPyEvalSlowThreshold = 0.01
+PyEvalSlowCallsCount = 100
+# Length of code reported in statistics
+PyEvalSnippetLength = 80
+# Repeated py_eval exceptions are summarized once per period, in seconds
+DefaultPyEvalErrorLogPeriod = 10
+
+
+class PyEvalCache(object):
+    """
+    Bounded LRU cache of py_eval compiled expressions.
+    Keyed by code only, so that blocks evaluating identical
+    code share the same compiled expression.
+    """
+    def __init__(self, size=DefaultPyEvalCacheSize):
+        self.size = size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, cmd):
+        """
+        return compiled cmd, compiling it if not in cache
+        """
+        AST = self.cache.get(cmd, None)
+        if AST is not None:
+            self.hits += 1
+            self.cache.move_to_end(cmd)
+            return AST
+        self.misses += 1
+        # compile errors are raised to caller, and not cached
+        AST = compile(cmd, '<plc>', 'eval')
+        self.cache[cmd] = AST
+        while len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+            self.evictions += 1
+        return AST
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        return dict(size=self.size,
+                    entries=len(self.cache),
+                    hits=self.hits,
+                    misses=self.misses,
+                    evictions=self.evictions)
+
+
+# Returned to py_eval blocks whose result is still being awaited
+PyEvalPendingMarker = "#PENDING"
+
+
+async def _await(awaitable):
+    return await awaitable
+
+
+def _chain_future(source, destination):
+    """
+    resolve concurrent Future destination with asyncio future source,
+    must be called from loop of source. Cancelling destination cancels
+    source.
+    """
+    loop = source.get_loop()
+
+    def copy(source):
+        try:
+            if source.cancelled():
+                destination.cancel()
+            elif source.exception() is not None:
+                destination.set_exception(source.exception())
+            else:
+                destination.set_result(source.result())
+        except InvalidStateError:
+            # destination was cancelled meanwhile
+            pass
+
+    def cancel(destination):
+        if destination.cancelled():
+            try:
+                loop.call_soon_threadsafe(source.cancel)
+            except RuntimeError:
+                # loop of source is closed
+                pass
+
+    destination.add_done_callback(cancel)
+    source.add_done_callback(copy)
+
+
+class PyEvalAsync(object):
+    """
+    Run py_eval results that are coroutines or futures on a dedicated
+    asyncio loop thread, and keep one pending result per block.
+    """
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self.pending = {}
+
+    @staticmethod
+    def awaitable(result):
+        return isinstance(result, Future) or inspect.isawaitable(result)
+
+    def _start(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.loop.run_forever, name="PLCPyEvalAsync")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, FBID, result):
+        """
+        wait for result in background, on behalf of block FBID
+        """
+        if isinstance(result, Future):
+            pass
+        elif asyncio.isfuture(result) and result.get_loop() is not self.loop:
+            # asyncio futures can only be used from their own loop
+            future = Future()
+            try:
+                result.get_loop().call_soon_threadsafe(
+                    _chain_future, result, future)
+            except RuntimeError as e:
+                future.set_exception(e)
+            result = future
+        else:
+            if self.loop is None:
+                self._start()
+            if not asyncio.iscoroutine(result):
+                result = _await(result)
+            result = asyncio.run_coroutine_threadsafe(result, self.loop)
+        self.pending[FBID] = result
+
+    def collect(self, FBID):
+        """
+        return None if block FBID has nothing pending, or
+        (done, result, exception) of its pending result
+        """
+        future = self.pending.get(FBID, None)
+        if future is None:
+            return None
+        if not future.done():
+            return False, None, None
+        self.pending.pop(FBID)
+        try:
+            return True, future.result(), None
+        except (CancelledError, Exception) as e:
+            return True, None, e
+
+    def cancel(self):
+        """
+        forget pending results
+        """
+        for future in self.pending.values():
+            future.cancel()
+        self.pending = {}
+
+    def stop(self):
+        self.cancel()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            # let cancelled tasks finish
+            tasks = asyncio.all_tasks(self.loop)
+            if tasks:
+                self.loop.run_until_complete(
+                    asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+            self.loop = None
+            self.thread = None
+
+
+class PyEvalStats(object):
+    """
+    Compile, eval and encode latencies of py_eval calls, per block,
+    and ring of slowest calls
+    """
+    Phases = ["compile", "eval", "encode"]
+
+    def __init__(self, threshold=DefaultPyEvalSlowThreshold):
+        self.threshold = threshold
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # FBID -> [code, {phase: histogram}]
+            self.blocks = {}
+            self.slow = deque(maxlen=PyEvalSlowCallsCount)
+
+    def record(self, FBID, cmd, durations):
+        """
+        record (compile, eval, encode) durations of one call of block FBID
+        """
+        with self.lock:
+            block = self.blocks.get(FBID, None)
+            if block is None:
+                block = [cmd, {phase: LatencyHistogram() for phase in self.Phases}]
+                self.blocks[FBID] = block
+            block[0] = cmd
+            for phase, duration in zip(self.Phases, durations):
+                block[1][phase].record(duration)
+            total = sum(durations)
+            if total >= self.threshold:
+                self.slow.append((time(), FBID, cmd[:PyEvalSnippetLength], total))
+
+    def get(self, top=10):
+        """
+        return blocks spending most time overall, and slow calls
+        """
+        with self.lock:
+            blocks = []
+            for FBID, (cmd, histograms) in self.blocks.items():
+                stats = {phase: h.summary() for phase, h in histograms.items()}
+                total = sum(s["total"] for s in stats.values())
+                blocks.append(dict(FBID=FBID,
+                                   code=cmd[:PyEvalSnippetLength],
+                                   total=total,
+                                   **stats))
+            slow = list(self.slow)
+        blocks.sort(key=lambda block: block["total"], reverse=True)
+        return dict(top=blocks[:top], slow=slow)
+
+
+class PyEvalErrorLog(object):
+    """
+    Deduplicate py_eval exceptions by (FBID, exception type, line), so that
+    a block failing every cycle doesn't flood PLC log.
+    """
+    def __init__(self, period=DefaultPyEvalErrorLogPeriod):
+        self.period = period
+        # key -> [repeats not logged yet, last log time, last exception]
+        self.errors = {}
+
+    def report(self, key, e):
+        """
+        return None if exception must not be logged, or
+        count of repeats not logged since last time (0 if first occurence)
+        """
+        now = time()
+        error = self.errors.get(key, None)
+        if error is None:
+            self.errors[key] = [0, now, e]
+            return 0
+        error[0] += 1
+        error[2] = e
+        if now - error[1] < self.period:
+            return None
+        repeats = error[0]
+        error[0] = 0
+        error[1] = now
+        return repeats
+
+    def flush(self):
+        """
+        return (key, repeats, last exception) of repeats not logged yet,
+        and forget all exceptions
+        """
+        res = [(key, repeats, e)
+               for key, (repeats, _t, e) in self.errors.items()
+               if repeats]
+        self.errors = {}
+        return res
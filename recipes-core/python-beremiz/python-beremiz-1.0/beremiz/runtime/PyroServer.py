@@ -33,10 +33,22 @@ def make_pyro_exposed_stub(method_name):
 class PLCObjectPyroAdapter(type("PLCObjectPyroStubs", (), {
     name: make_pyro_exposed_stub(name) for name in [
         "AppendChunkToBlob",
+        "CreateBlob",
+        "FinalizeBlob",
         "GetLogMessage",
         "GetPLCID",
         "GetPLCstatus",
+        "GetPLCstatusSnapshot",
+        "GetPyEvalCacheStats",
+        "GetPyEvalStats",
+        "GetTraceBufferStats",
         "GetTraceVariables",
+        "GetTraceVariablesColumnar",
+        "GetTraceDecimated",
+        "GetTraceHistory",
+        "GetTraceStatistics",
+        "GetTraceTrigger",
+        "GetWorkerStatus",
         "MatchMD5", 
         "NewPLC",
         "PurgeBlobs",
@@ -44,9 +56,13 @@ class PLCObjectPyroAdapter(type("PLCObjectPyroStubs", (), {
         "RepairPLC",
         "ResetLogCount",
         "SeedBlob",
+        "SetTraceTrigger",
         "SetTraceVariablesList",
         "StartPLC",
-        "StopPLC"
+        "StartTraceRecording",
+        "StopPLC",
+        "StopTraceRecording",
+        "WriteBlobChunk"
     ]
 })):
     def __init__(self, plc_object_instance):
@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of Beremiz runtime.
+#
+# See COPYING.Runtime file for copyrights details.
+
+import os
+import json
+import mmap
+import struct
+import shutil
+from bisect import bisect_left
+from threading import Lock, Condition, Thread
+from time import time
+
+# segment file starts with magic and count of bytes used by records
+SegmentHeader = struct.Struct("=8sQ")
+SegmentMagic = b"BRZTRC01"
+# each record is (tick, time, data size) followed by data
+RecordHeader = struct.Struct("=IdI")
+# one index entry every IndexStride records
+IndexStride = 64
+
+
+class TraceSegment(object):
+    """
+    One memory mapped file of trace records,
+    with a sparse (time, offset) index
+    """
+    def __init__(self, path, size=None):
+        self.path = path
+        if size is not None:
+            # new segment, preallocated
+            with open(path, "wb") as f:
+                f.truncate(size)
+            self.fd = os.open(path, os.O_RDWR)
+            self.map = mmap.mmap(self.fd, size)
+            self.used = SegmentHeader.size
+            self.map[:SegmentHeader.size] = SegmentHeader.pack(
+                SegmentMagic, self.used)
+        else:
+            # existing segment, read only
+            self.fd = os.open(path, os.O_RDONLY)
+            self.map = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+            magic, self.used = SegmentHeader.unpack_from(self.map)
+            if magic != SegmentMagic or self.used > len(self.map):
+                self.close()
+                raise ValueError("Invalid trace segment " + path)
+        self.count = 0
+        self.index = []
+        self.first_time = None
+        self.last_time = None
+        self._scan(SegmentHeader.size)
+
+    def _scan(self, offset):
+        """
+        index records from offset up to used size
+        """
+        while offset < self.used:
+            _tick, t, size = RecordHeader.unpack_from(self.map, offset)
+            self._indexed(t, offset)
+            offset += RecordHeader.size + size
+
+    def _indexed(self, t, offset):
+        if self.count % IndexStride == 0:
+            self.index.append((t, offset))
+        if self.first_time is None:
+            self.first_time = t
+        self.last_time = t
+        self.count += 1
+
+    def room(self):
+        return len(self.map) - self.used
+
+    def write(self, records):
+        """
+        write (tick, time, data) records, that must fit in room left
+        """
+        offset = self.used
+        for tick, t, data in records:
+            end = offset + RecordHeader.size + len(data)
+            RecordHeader.pack_into(self.map, offset, tick, t, len(data))
+            self.map[offset + RecordHeader.size:end] = data
+            self._indexed(t, offset)
+            offset = end
+        self.used = offset
+        SegmentHeader.pack_into(self.map, 0, SegmentMagic, self.used)
+        self.map.flush()
+
+    def read(self, start_time, end_time, max_samples):
+        """
+        return (tick, time, data) records between start and end time
+        """
+        res = []
+        pos = bisect_left(self.index, (start_time,)) - 1
+        offset = self.index[pos][1] if pos >= 0 else SegmentHeader.size
+        while offset < self.used and len(res) < max_samples:
+            tick, t, size = RecordHeader.unpack_from(self.map, offset)
+            if t > end_time:
+                break
+            start = offset + RecordHeader.size
+            offset = start + size
+            if t >= start_time:
+                res.append((tick, t, self.map[start:offset]))
+        return res
+
+    def seal(self):
+        """
+        shrink segment to its used size, and map it read only
+        """
+        self.close(shrink=True)
+        self.fd = os.open(self.path, os.O_RDONLY)
+        self.map = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+
+    def close(self, shrink=False):
+        self.map.close()
+        if shrink:
+            os.ftruncate(self.fd, self.used)
+        os.close(self.fd)
+
+    def filesize(self):
+        return len(self.map) if not self.map.closed else self.used
+
+
+class TraceRecorder(object):
+    """
+    Record trace samples in segmented memory mapped files, so that PLC can
+    be traced at full rate without client connected. Writes are batched to
+    limit flash wear, and done by a writer thread so that storage latency
+    doesn't delay trace thread. Old segments are removed by size and age.
+    """
+    def __init__(self, directory, idxs,
+                 segment_size=4 * 1024 * 1024,
+                 max_size=64 * 1024 * 1024,
+                 max_age=7 * 24 * 3600,
+                 batch_size=256,
+                 batch_delay=1.0):
+        self.directory = directory
+        self.idxs = [[idx, iectype] for idx, iectype, _force in idxs]
+        self.segment_size = segment_size
+        self.max_size = max_size
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        # lock protects pending samples, io_lock protects segments
+        self.lock = Lock()
+        self.wakeup = Condition(self.lock)
+        self.io_lock = Lock()
+        self.pending = []
+        self.segments = []
+        self.current = None
+        self.next_segment = 0
+        self.closed = False
+        self._open()
+        self.writer = Thread(target=self._writer, name="PLCTraceRecorder")
+        self.writer.daemon = True
+        self.writer.start()
+
+    def _variables_path(self):
+        return os.path.join(self.directory, "variables.json")
+
+    def _open(self):
+        """
+        reuse previous recording of the same variables, or start afresh
+        """
+        try:
+            previous = json.load(open(self._variables_path()))
+        except Exception:
+            previous = None
+        if previous != self.idxs and os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+            with open(self._variables_path(), "w") as f:
+                json.dump(self.idxs, f)
+        for filename in sorted(os.listdir(self.directory)):
+            name, ext = os.path.splitext(filename)
+            # only segments named by _new_segment
+            if ext != ".seg" or not name.isdigit():
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                segment = TraceSegment(path)
+            except Exception:
+                os.remove(path)
+                continue
+            self.segments.append(segment)
+            self.next_segment = max(self.next_segment, int(name) + 1)
+
+    def _new_segment(self, size):
+        if self.current is not None:
+            self.current.seal()
+        path = os.path.join(self.directory, "%08d.seg" % self.next_segment)
+        self.next_segment += 1
+        self.current = TraceSegment(path, max(size, self.segment_size))
+        self.segments.append(self.current)
+        self._retention()
+
+    def _retention(self):
+        limit = time() - self.max_age
+        total = sum(segment.filesize() for segment in self.segments)
+        while len(self.segments) > 1:
+            oldest = self.segments[0]
+            if total <= self.max_size and \
+               (oldest.last_time is None or oldest.last_time >= limit):
+                break
+            total -= oldest.filesize()
+            oldest.close()
+            os.remove(oldest.path)
+            self.segments.pop(0)
+
+    def append(self, samples):
+        """
+        queue (tick, data) samples for writer thread, never blocks on I/O
+        """
+        t = time()
+        with self.lock:
+            if self.closed:
+                return
+            self.pending.extend((tick, t, data) for tick, data in samples)
+            if len(self.pending) >= self.batch_size:
+                self.wakeup.notify()
+
+    def _writer(self):
+        """
+        write pending samples once batch is complete or batch delay elapsed
+        """
+        while True:
+            with self.lock:
+                self.wakeup.wait_for(
+                    lambda: self.closed or len(self.pending) >= self.batch_size,
+                    self.batch_delay)
+                if self.closed:
+                    return
+            self.flush()
+
+    def _take_pending(self):
+        with self.lock:
+            records = self.pending
+            self.pending = []
+        return records
+
+    def _write(self, records):
+        """
+        write records in segments, io_lock must be held
+        """
+        while records:
+            if self.current is None:
+                self._new_segment(0)
+            room = self.current.room()
+            batch = []
+            for record in records:
+                size = RecordHeader.size + len(record[2])
+                if size > room:
+                    break
+                batch.append(record)
+                room -= size
+            if batch:
+                self.current.write(batch)
+                records = records[len(batch):]
+            else:
+                self._new_segment(RecordHeader.size + len(records[0][2]) +
+                                  SegmentHeader.size)
+
+    def flush(self):
+        with self.io_lock:
+            self._write(self._take_pending())
+
+    def read(self, start_time, end_time, max_samples=100000):
+        """
+        return recorded (tick, time, data) samples between start and end time
+        """
+        res = []
+        with self.io_lock:
+            self._write(self._take_pending())
+            for segment in self.segments:
+                if segment.last_time is None or \
+                   segment.last_time < start_time or \
+                   segment.first_time > end_time:
+                    continue
+                res.extend(segment.read(start_time, end_time,
+                                        max_samples - len(res)))
+                if len(res) >= max_samples:
+                    break
+        return res
+
+    def stats(self):
+        with self.lock:
+            pending = len(self.pending)
+        with self.io_lock:
+            return dict(segments=len(self.segments),
+                        size=sum(segment.filesize() for segment in self.segments),
+                        samples=sum(segment.count for segment in self.segments),
+                        pending=pending,
+                        first_time=self.segments[0].first_time if self.segments else None,
+                        last_time=self.segments[-1].last_time if self.segments else None)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.wakeup.notify()
+        self.writer.join()
+        with self.io_lock:
+            self._write(self._take_pending())
+            if self.current is not None:
+                self.current.close(shrink=True)
+                self.segments.remove(self.current)
+                self.current = None
+            for segment in self.segments:
+                segment.close()
+            self.segments = []
@@ -0,0 +1,640 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of Beremiz runtime.
+#
+# See COPYING.Runtime file for copyrights details.
+
+from collections import deque
+from itertools import islice
+from time import time
+from datetime import timedelta
+import ctypes
+import struct
+from math import sqrt
+from threading import Lock
+
+from runtime.typemapping import GetDebugBufferDecoder
+
+# Default memory budget of trace samples kept between two polls
+DefaultTraceBudget = 1024 * 1024
+
+
+class TraceRingBuffer(object):
+    """
+    Byte accounted ring buffer of (tick, data) trace samples.
+    Sample data is copied in a preallocated buffer, and oldest samples are
+    evicted when a new sample doesn't fit in memory budget.
+    Samples are numbered, so that several readers can keep their own cursor.
+    Not thread safe : caller must serialize accesses.
+    """
+    def __init__(self, budget=DefaultTraceBudget):
+        self.budget = budget
+        self.buffer = bytearray(budget)
+        self.view = memoryview(self.buffer)
+        # keeps buffer exported, so that its address can't change
+        self._cbuffer = (ctypes.c_char * budget).from_buffer(self.buffer)
+        self.address = ctypes.addressof(self._cbuffer)
+        # (tick, offset, size) of stored samples, oldest first
+        self.records = deque()
+        self.head = 0
+        self.used = 0
+        self.dropped = 0
+        # sequence number of oldest stored sample
+        self.first_seq = 0
+
+    @property
+    def next_seq(self):
+        """
+        sequence number of next appended sample
+        """
+        return self.first_seq + len(self.records)
+
+    def _reserve(self, size):
+        """
+        find room for size bytes, evicting oldest samples if necessary
+        return offset of reserved room, or None if sample can't fit at all
+        """
+        if size > self.budget:
+            self.dropped += 1
+            return None
+        records = self.records
+        if self.head + size > self.budget:
+            # no room left at end of buffer, wrap around
+            while records and records[0][1] >= self.head:
+                self._evict()
+            self.head = 0
+        end = self.head + size
+        while records and self.head <= records[0][1] < end:
+            self._evict()
+        offset = self.head
+        self.head = end
+        self.used += size
+        return offset
+
+    def _evict(self, dropped=True):
+        _tick, _offset, size = self.records.popleft()
+        self.first_seq += 1
+        self.used -= size
+        if dropped:
+            self.dropped += 1
+        if not self.records:
+            self.head = 0
+
+    def append(self, tick, data):
+        """
+        copy a bytes-like sample in buffer
+        """
+        size = len(data)
+        offset = self._reserve(size)
+        if offset is not None:
+            self.view[offset:offset + size] = data
+            self.records.append((tick, offset, size))
+
+    def append_from_address(self, tick, address, size):
+        """
+        copy a sample directly from memory (i.e. PLC debug buffer)
+        return a view on stored sample, or None if it was dropped
+        """
+        offset = self._reserve(size)
+        if offset is None:
+            return None
+        ctypes.memmove(self.address + offset, address, size)
+        self.records.append((tick, offset, size))
+        return self.view[offset:offset + size]
+
+    def read(self, seq):
+        """
+        return samples stored since sequence number seq as a list of
+        (tick, bytes), and count of samples evicted before being read
+        """
+        start = seq - self.first_seq
+        lost = 0
+        if start < 0:
+            lost = -start
+            start = 0
+        view = self.view
+        samples = [(tick, bytes(view[offset:offset + size]))
+                   for tick, offset, size in islice(self.records, start, None)]
+        return samples, lost
+
+    def trim(self, seq):
+        """
+        forget samples older than sequence number seq, already read by all
+        """
+        while self.records and self.first_seq < seq:
+            self._evict(dropped=False)
+
+    def drain(self):
+        """
+        return all stored samples as a list of (tick, bytes), and empty buffer
+        """
+        samples, _lost = self.read(self.first_seq)
+        self.clear()
+        return samples
+
+    def clear(self, dropped=False):
+        """
+        forget all samples, optionally counting them as dropped
+        """
+        if dropped:
+            self.dropped += len(self.records)
+        self.first_seq = self.next_seq
+        self.records.clear()
+        self.head = 0
+        self.used = 0
+
+    def stats(self):
+        return dict(budget=self.budget,
+                    used=self.used,
+                    samples=len(self.records),
+                    dropped=self.dropped)
+
+
+# Encodings of samples returned by GetTraceVariables
+TraceEncodings = ["raw", "delta"]
+
+# Count of samples between two keyframes in delta encoding
+DeltaKeyframeInterval = 100
+
+
+class TraceDeltaEncoder(object):
+    """
+    Encode (tick, buffer) samples into (tick, mask, data) samples.
+    mask is a bitmap of variables that changed since previous sample,
+    and data is the concatenation of new values of these variables.
+    Keyframes have an empty mask and whole buffer as data, they are sent
+    for first sample and then periodically so that clients can resync.
+    """
+    def __init__(self, decoder, keyframe_interval=DeltaKeyframeInterval):
+        self.decoder = decoder
+        self.keyframe_interval = keyframe_interval
+        # serializes reading and encoding of samples by caller
+        self.lock = Lock()
+        self.masksize = (len(decoder.iectypes) + 7) // 8
+        self.previous = None
+        self.count = 0
+
+    def encode(self, samples):
+        res = []
+        for tick, buff in samples:
+            bounds = self.decoder.bounds(buff)
+            values = None if bounds is None else \
+                [buff[start:end] for start, end in bounds]
+            if values is None or self.previous is None or \
+               self.count >= self.keyframe_interval:
+                res.append((tick, b"", buff))
+                self.count = 0
+            else:
+                mask = bytearray(self.masksize)
+                changed = []
+                for i, (value, previous) in enumerate(zip(values, self.previous)):
+                    if value != previous:
+                        mask[i >> 3] |= 1 << (i & 7)
+                        changed.append(value)
+                res.append((tick, bytes(mask), b"".join(changed)))
+                self.count += 1
+            self.previous = values
+        return res
+
+
+class TraceDeltaDecoder(object):
+    """
+    Client side counterpart of TraceDeltaEncoder,
+    rebuilds (tick, buffer) samples from delta encoded samples.
+    Samples received before first keyframe are dropped.
+    """
+    def __init__(self, decoder):
+        self.decoder = decoder
+        self.previous = None
+
+    def decode(self, samples):
+        res = []
+        for tick, mask, data in samples:
+            if not mask:
+                bounds = self.decoder.bounds(data)
+                self.previous = None if bounds is None else \
+                    [data[start:end] for start, end in bounds]
+            elif self.previous is not None:
+                values = list(self.previous)
+                offset = 0
+                for i in range(len(values)):
+                    if mask[i >> 3] & (1 << (i & 7)):
+                        iectype = self.decoder.iectypes[i]
+                        size = 1 + data[offset] if iectype == "STRING" \
+                            else len(values[i])
+                        values[i] = data[offset:offset + size]
+                        offset += size
+                self.previous = values
+            if self.previous is not None:
+                res.append((tick, b"".join(self.previous)))
+        return res
+
+
+# Header of each sample packed by PackTraceSamples : tick, size
+PackedSampleHeader = struct.Struct("=II")
+
+
+def PackTraceSamples(samples):
+    """
+    pack (tick, bytes) samples in one compact binary payload
+    """
+    return b"".join([PackedSampleHeader.pack(tick, len(buff)) + buff
+                     for tick, buff in samples])
+
+
+def UnpackTraceSamples(payload):
+    """
+    return (tick, bytes) samples packed by PackTraceSamples
+    """
+    res = []
+    offset = 0
+    while offset < len(payload):
+        tick, size = PackedSampleHeader.unpack_from(payload, offset)
+        offset += PackedSampleHeader.size
+        res.append((tick, bytes(payload[offset:offset + size])))
+        offset += size
+    return res
+
+
+# Subscribers not polling traces for that long (s) are forgotten
+TraceSubscriberTimeout = 3
+# Period (s) of checks for subscribers that timed out
+TraceSubscriberCheckPeriod = 1
+
+
+class TraceSubscriber(object):
+    """
+    One client of trace broker, with its own variables list,
+    cursor in shared sample stream and encoding.
+    """
+    def __init__(self, token, idxs, encoding, persistent=False):
+        self.token = token
+        # persistent subscribers never time out
+        self.persistent = persistent
+        self.idxs = list(idxs)
+        self.decoder = GetDebugBufferDecoder(
+            [iectype for _idx, iectype, _force in self.idxs])
+        self.encoder = TraceDeltaEncoder(self.decoder) \
+            if encoding == "delta" else None
+        # sequence number of next sample to be read in ring buffer
+        self.cursor = 0
+        # positions of subscribed variables in registered variables
+        self.positions = None
+        # samples already projected, kept when registered variables change
+        self.pending = []
+        self.dropped = 0
+        self.last_poll = time()
+        # objects fed with each decoded sample, see TraceBroker.feed
+        self.consumers = []
+        self.decimator = None
+        self.statistics = None
+        self.trigger = None
+        self.recorder = None
+
+    def alive(self, now):
+        return self.persistent or \
+            now - self.last_poll <= TraceSubscriberTimeout
+
+
+class TraceBroker(object):
+    """
+    Share one set of PLC debug variables among several trace subscribers.
+    Registered variables are the union of variables of all subscribers,
+    ordered by index as in PLC debug buffer. Each subscriber reads the
+    shared sample stream from its own cursor, projected on its variables.
+    Only newest subscriber forces variables, as a new variables list
+    replaced previous one before subscribers were shared.
+    Not thread safe : caller must serialize accesses.
+    """
+    def __init__(self, ring):
+        self.ring = ring
+        self.subscribers = {}
+        self.registered = []
+        self.decoder = None
+        # token of subscriber whose forced values are registered
+        self.forcing = None
+
+    def live_subscribers(self):
+        now = time()
+        return [sub for sub in self.subscribers.values() if sub.alive(now)]
+
+    def expired(self):
+        """
+        return True if some subscribers didn't poll recently
+        """
+        now = time()
+        return any(not sub.alive(now) for sub in self.subscribers.values())
+
+    def prune(self):
+        """
+        forget subscribers that didn't poll recently
+        """
+        now = time()
+        for token, sub in list(self.subscribers.items()):
+            if not sub.alive(now):
+                self.subscribers.pop(token)
+        self._trim()
+
+    def union(self, subscribers, forcing):
+        """
+        return (idx, iectype, force) list of variables to register
+        for given subscribers. Only variables of subscriber whose token
+        is forcing are forced, others are registered with None force.
+        """
+        merged = {}
+        for sub in sorted(subscribers, key=lambda sub: sub.token):
+            for idx, iectype, force in sub.idxs:
+                if sub.token != forcing:
+                    force = merged[idx][2] if idx in merged else None
+                merged[idx] = (idx, iectype, force)
+        return [merged[idx] for idx in sorted(merged)]
+
+    def update(self, registered, forcing):
+        """
+        switch to union of variables now registered in PLC. Samples already
+        in ring buffer are projected for subscribers before switching layout.
+        """
+        self.forcing = forcing
+        if registered == self.registered:
+            return
+        for sub in self.subscribers.values():
+            sub.pending.extend(self._read(sub))
+        self.ring.clear()
+        self.registered = registered
+        self.decoder = GetDebugBufferDecoder(
+            [iectype for _idx, iectype, _force in registered])
+        for sub in self.subscribers.values():
+            self._locate(sub)
+
+    def subscribe(self, sub, registered):
+        """
+        add newest subscriber, registered being union of variables now
+        registered in PLC.
+        """
+        self.update(registered, sub.token)
+        self.subscribers[sub.token] = sub
+        self._locate(sub)
+        sub.cursor = self.ring.next_seq
+
+    def unsubscribe(self, sub):
+        self.subscribers.pop(sub.token, None)
+        self._trim()
+
+    def clear(self):
+        self.subscribers.clear()
+        self.registered = []
+        self.decoder = None
+        self.forcing = None
+        self.ring.clear()
+
+    def _locate(self, sub):
+        registered = [idx for idx, _iectype, _force in self.registered]
+        positions = [registered.index(idx) for idx, _iectype, _force in sub.idxs]
+        # same variables in same order, no projection needed
+        sub.positions = None if positions == list(range(len(registered))) \
+            else positions
+
+    def _project(self, sub, buff):
+        """
+        return subscriber's part of a sample, or None if sample is invalid
+        """
+        if sub.positions is None:
+            return bytes(buff)
+        bounds = self.decoder.bounds(buff)
+        if bounds is None:
+            return None
+        return b"".join(
+            [buff[bounds[pos][0]:bounds[pos][1]] for pos in sub.positions])
+
+    def _read(self, sub):
+        samples, lost = self.ring.read(sub.cursor)
+        sub.cursor = self.ring.next_seq
+        sub.dropped += lost
+        if sub.positions is None:
+            return samples
+        res = []
+        for tick, buff in samples:
+            buff = self._project(sub, buff)
+            if buff is None:
+                sub.dropped += 1
+                continue
+            res.append((tick, buff))
+        return res
+
+    def _trim(self):
+        cursors = [sub.cursor for sub in self.live_subscribers()]
+        self.ring.trim(min(cursors) if cursors else self.ring.next_seq)
+
+    def feed(self, tick, buff):
+        """
+        decode a new sample once, and pass projected values to consumers
+        of subscribers. Called by trace thread for each sample.
+        """
+        subscribers = [sub for sub in self.subscribers.values()
+                       if sub.consumers]
+        if not subscribers or buff is None:
+            return
+        values = self.decoder.decode(buff)
+        if values is None:
+            return
+        for sub in subscribers:
+            subvalues = values if sub.positions is None else \
+                [values[pos] for pos in sub.positions]
+            subbuff = None
+            for consumer in sub.consumers:
+                if consumer.raw and subbuff is None:
+                    subbuff = self._project(sub, buff)
+                consumer.feed(tick, subvalues, subbuff)
+
+    def skip(self, sub):
+        """
+        mark subscriber as alive, without reading raw samples
+        """
+        sub.last_poll = time()
+        sub.cursor = self.ring.next_seq
+        self._trim()
+
+    def read(self, sub):
+        """
+        return samples not yet read by subscriber, as (tick, bytes) list
+        """
+        sub.last_poll = time()
+        samples = sub.pending + self._read(sub)
+        sub.pending = []
+        self._trim()
+        return samples
+
+
+# Maximum count of buckets kept by TraceDecimator
+DecimatorMaxBuckets = 10000
+
+
+def _numeric(value):
+    """
+    value as a number for aggregation, or None if not possible
+    """
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return None
+
+
+class TraceDecimator(object):
+    """
+    Keep min/max/first/last aggregates of each variable over fixed size
+    buckets of ticks, so that long time windows can be plotted without
+    transferring every sample. Non numeric variables aggregate to None.
+    """
+    # only decoded values are needed
+    raw = False
+
+    def __init__(self, bucket, maxbuckets=DecimatorMaxBuckets):
+        self.bucket = max(1, int(bucket))
+        # (bucket first tick, [[min, max, first, last], ...]), oldest first
+        self.buckets = deque(maxlen=maxbuckets)
+        self.current = None
+
+    def feed(self, tick, values, _buff):
+        start = tick - tick % self.bucket
+        if self.current is None or self.current[0] != start:
+            self.current = (start, [None if v is None else [v, v, v, v]
+                                    for v in map(_numeric, values)])
+            self.buckets.append(self.current)
+            return
+        for agg, value in zip(self.current[1], values):
+            if agg is not None:
+                value = _numeric(value)
+                if value < agg[0]:
+                    agg[0] = value
+                elif value > agg[1]:
+                    agg[1] = value
+                agg[3] = value
+
+    def get(self, start_tick, end_tick, points):
+        """
+        return at most points (first tick, aggregates) tuples covering
+        buckets between start_tick and end_tick, aggregates being a
+        (min, max, first, last) list for each variable
+        """
+        selected = [bucket for bucket in self.buckets
+                    if start_tick <= bucket[0] <= end_tick]
+        if not selected or points < 1:
+            return []
+        group = -(-len(selected) // points)
+        res = []
+        for i in range(0, len(selected), group):
+            buckets = selected[i:i + group]
+            aggs = []
+            for var_aggs in zip(*[aggregates for _start, aggregates in buckets]):
+                if var_aggs[0] is None:
+                    aggs.append(None)
+                else:
+                    aggs.append((min(agg[0] for agg in var_aggs),
+                                 max(agg[1] for agg in var_aggs),
+                                 var_aggs[0][2],
+                                 var_aggs[-1][3]))
+            res.append((buckets[0][0], aggs))
+        return res
+
+
+# Trigger conditions, given previous and current value, and threshold
+TriggerConditions = {
+    "rising":  lambda prev, value, threshold: prev <= threshold < value,
+    "falling": lambda prev, value, threshold: prev >= threshold > value,
+    "change":  lambda prev, value, threshold: prev != value,
+}
+
+
+class TraceTrigger(object):
+    """
+    Oscilloscope like capture : keep pre-trigger samples in a ring,
+    evaluate condition on one variable of each sample, and once fired
+    keep post-trigger samples. Captured window is then kept until re-armed.
+    """
+    raw = True
+
+    def __init__(self, position, condition, threshold=0, pre=100, post=100):
+        self.position = position
+        self.condition = TriggerConditions[condition]
+        self.threshold = threshold
+        self.pre = pre
+        self.post = post
+        self.rearm()
+
+    def rearm(self):
+        self.state = "armed"
+        self.ring = deque(maxlen=self.pre)
+        self.capture = []
+        self.remaining = 0
+        self.trigger_tick = None
+        self.previous = None
+
+    def feed(self, tick, values, buff):
+        if buff is None or self.state == "done":
+            return
+        if self.state == "triggered":
+            self.capture.append((tick, buff))
+            self.remaining -= 1
+            if self.remaining <= 0:
+                self.state = "done"
+            return
+        value = _numeric(values[self.position])
+        previous = self.previous
+        self.previous = value
+        if previous is not None and value is not None and \
+           self.condition(previous, value, self.threshold):
+            self.capture = list(self.ring) + [(tick, buff)]
+            self.ring.clear()
+            self.trigger_tick = tick
+            self.remaining = self.post
+            self.state = "triggered" if self.post > 0 else "done"
+        else:
+            self.ring.append((tick, buff))
+
+
+class TraceStatistics(object):
+    """
+    Running count, min, max, mean, standard deviation and last value of
+    each variable, since last reset. Mean and variance use Welford's
+    algorithm. Non numeric variables only get count and last value.
+    """
+    raw = False
+
+    def __init__(self, count):
+        self.size = count
+        self.reset()
+
+    def reset(self):
+        # [count, min, max, mean, M2, last] for each variable
+        self.stats = [[0, None, None, 0.0, 0.0, None]
+                      for _i in range(self.size)]
+
+    def feed(self, tick, values, _buff):
+        for stat, value in zip(self.stats, values):
+            number = _numeric(value)
+            stat[0] += 1
+            if number is None:
+                stat[5] = value
+                continue
+            stat[5] = number
+            if stat[0] == 1:
+                stat[1] = stat[2] = number
+            elif number < stat[1]:
+                stat[1] = number
+            elif number > stat[2]:
+                stat[2] = number
+            delta = number - stat[3]
+            stat[3] += delta / stat[0]
+            stat[4] += delta * (number - stat[3])
+
+    def get(self):
+        """
+        return (count, min, max, mean, stddev, last) for each variable
+        """
+        return [(count, vmin, vmax,
+                 mean if vmin is not None else None,
+                 sqrt(m2 / count) if vmin is not None else None,
+                 last)
+                for count, vmin, vmax, mean, m2, last in self.stats]
@@ -26,17 +26,20 @@ import time
 import json
 import os
 import re
+from functools import partial
 from autobahn.twisted import wamp
 from autobahn.twisted.websocket import WampWebSocketClientFactory, connectWS
 from autobahn.wamp import types, auth
 from autobahn.wamp.serializer import MsgPackSerializer
 from twisted.internet.protocol import ReconnectingClientFactory
+from twisted.internet import task, defer
 from twisted.python.components import registerAdapter
 
 from formless import annotate, webform
 import formless
 from nevow import tags, url, static
-from runtime import GetPLCObjectSingleton
+from runtime import GetPLCObjectSingleton, DeferredCall
+from runtime.Traces import PackTraceSamples
 
 mandatoryConfigItems = ["ID", "active", "realm", "url"]
 
@@ -52,15 +55,31 @@ ExposedCalls = [
     ("StartPLC", {}),
     ("StopPLC", {}),
     ("GetPLCstatus", {}),
+    ("GetPLCstatusSnapshot", {}),
     ("GetPLCID", {}),
     ("SeedBlob", {}),
     ("AppendChunkToBlob", {}),
+    ("CreateBlob", {}),
+    ("WriteBlobChunk", {}),
+    ("FinalizeBlob", {}),
     ("PurgeBlobs", {}),
     ("NewPLC", {}),
     ("RepairPLC", {}),
     ("MatchMD5", {}),
     ("SetTraceVariablesList", {}),
     ("GetTraceVariables", {}),
+    ("GetTraceVariablesColumnar", {}),
+    ("GetTraceDecimated", {}),
+    ("GetTraceHistory", {}),
+    ("GetTraceStatistics", {}),
+    ("SetTraceTrigger", {}),
+    ("GetTraceTrigger", {}),
+    ("StartTraceRecording", {}),
+    ("StopTraceRecording", {}),
+    ("GetTraceBufferStats", {}),
+    ("GetPyEvalCacheStats", {}),
+    ("GetPyEvalStats", {}),
+    ("GetWorkerStatus", {}),
     ("RemoteExec", {}),
     ("GetLogMessage", {}),
     ("ResetLogCount", {})
@@ -92,6 +111,13 @@ DoOnJoin = []
 
 lastKnownConfig = None
 
+# running trace streams, DebugToken -> LoopingCall
+TraceStreams = {}
+
+# Default and minimal period of trace streams publications (ms)
+DefaultTraceStreamPeriod = 100
+MinTraceStreamPeriod = 10
+
 
 def GetCallee(name):
     """ Get Callee or Subscriber corresponding to '.' spearated object path """
@@ -136,10 +162,16 @@ class WampSession(wamp.ApplicationSession):
                 registerOptions = None
                 print(_("TypeError register option: {}".format(e)))
 
-            self.register(GetCallee(name), '.'.join((ID, name)), registerOptions)
+            # RunInMain methods must not block reactor
+            self.register(partial(DeferredCall, GetCallee(name)),
+                          '.'.join((ID, name)), registerOptions)
+
+        for name, callee in [("StartTraceStream", StartTraceStream),
+                             ("StopTraceStream", StopTraceStream)]:
+            self.register(callee, '.'.join((ID, name)))
 
         for name in SubscribedEvents:
-            self.subscribe(GetCallee(name), str(name))
+            self.subscribe(partial(DeferredCall, GetCallee(name)), str(name))
 
         for func in DoOnJoin:
             func(self)
@@ -149,6 +181,7 @@ class WampSession(wamp.ApplicationSession):
     def onLeave(self, details):
         global _WampSession, _transportFactory
         super(WampSession, self).onLeave(details)
+        StopTraceStreams()
         _WampSession = None
         _transportFactory = None
         print(_('WAMP session left'))
@@ -375,6 +408,52 @@ def PublishEventWithOwnID(eventID, value):
         _WampSession.publishWithOwnID(str(eventID), value)
 
 
+def StartTraceStream(idxs, period=DefaultTraceStreamPeriod):
+    """
+    Trace given variables and publish collected samples every period ms,
+    packed by PackTraceSamples, on "<ID>.trace.<DebugToken>" topic.
+    Period is clamped to MinTraceStreamPeriod.
+    Return Deferred DebugToken, or None if variables couldn't be traced.
+    """
+    period = max(period, MinTraceStreamPeriod)
+    PLCObject = GetPLCObjectSingleton()
+    # SubscribeTraces runs in main thread, don't block reactor
+    d = defer.maybeDeferred(DeferredCall, PLCObject.SubscribeTraces, idxs)
+    d.addCallback(StartTraceStreamPublisher, period)
+    return d
+
+
+def StartTraceStreamPublisher(sub, period):
+    if sub is None:
+        return None
+    PLCObject = GetPLCObjectSingleton()
+    DebugToken = sub.token
+    topic = "trace.%d" % DebugToken
+
+    def PublishTraces():
+        samples = PLCObject.ReadTraces(sub)
+        if samples is None:
+            StopTraceStream(DebugToken)
+        elif samples and getWampStatus() == "Attached":
+            _WampSession.publishWithOwnID(topic, PackTraceSamples(samples))
+
+    stream = task.LoopingCall(PublishTraces)
+    TraceStreams[DebugToken] = stream
+    stream.start(period / 1000.0, now=False)
+    return DebugToken
+
+
+def StopTraceStream(DebugToken):
+    stream = TraceStreams.pop(DebugToken, None)
+    if stream is not None and stream.running:
+        stream.stop()
+
+
+def StopTraceStreams():
+    for DebugToken in list(TraceStreams):
+        StopTraceStream(DebugToken)
+
+
 # WEB CONFIGURATION INTERFACE
 WAMP_SECRET_URL = "secret"
 webExposedConfigItems = [
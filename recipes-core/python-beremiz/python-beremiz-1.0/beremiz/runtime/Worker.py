@@ -8,7 +8,52 @@
 # See COPYING.Runtime file for copyrights details.
 
 
+from heapq import heappush, heappop
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+from functools import partial
 from threading import Lock, Condition, Thread, get_ident
+from time import time, perf_counter
+
+from runtime.Histogram import LatencyHistogram
+
+# Job priorities, lower value is executed first
+PriorityHigh = 0
+PriorityNormal = 1
+PriorityLow = 2
+
+# Max count of jobs waiting for worker, further calls are rejected
+DefaultMaxQueuedJobs = 64
+
+# Jobs waiting and running longer than that (seconds) are logged as slow jobs
+DefaultSlowJobThreshold = 1.0
+SlowJobsCount = 100
+
+
+class WorkerQueueFull(Exception):
+    """
+    raised when calling a worker that has too many jobs waiting
+    """
+
+
+def DeferredFromFuture(future):
+    """
+    return twisted Deferred fired in reactor thread once future is done
+    """
+    from twisted.internet import defer, reactor
+
+    d = defer.Deferred()
+
+    def done(future):
+        try:
+            result = future.result()
+        except Exception as e:
+            reactor.callFromThread(d.errback, e)
+        else:
+            reactor.callFromThread(d.callback, result)
+
+    future.add_done_callback(done)
+    return d
 
 
 class job(object):
@@ -20,11 +65,29 @@ class job(object):
         self.result = None
         self.success = None
         self.exc_info = None
+        self.cancelled = False
+        # set when job was submitted instead of called
+        self.future = None
+        # perf_counter() when job was queued, passed to waker, started, ended
+        self.enqueued = None
+        self.dispatched = None
+        self.started = None
+        self.ended = None
+
+    def name(self):
+        call = self.job[0]
+        return getattr(call, "__qualname__", None) or repr(call)
 
     def do(self):
         """
         do the job by executing the call, and deal with exceptions
         """
+        if self.future is not None and \
+           not self.future.set_running_or_notify_cancel():
+            # submitter cancelled the future meanwhile, skip job
+            self.cancelled = True
+            return
+        self.started = perf_counter()
         try:
             call, args, kwargs = self.job
             self.result = call(*args, **kwargs)
@@ -32,24 +95,97 @@ class job(object):
         except Exception as e:
             self.success = False
             self.exc_info = e
+        self.ended = perf_counter()
+        if self.success:
+            self._resolve("set_result", self.result)
+        else:
+            self._resolve("set_exception", self.exc_info)
+
+    def _resolve(self, setter, value):
+        """
+        set submitter's future, if any, never raising in worker thread
+        """
+        if self.future is None:
+            return
+        try:
+            getattr(self.future, setter)(value)
+        except InvalidStateError:
+            pass
+
+    def cancel(self):
+        self.cancelled = True
+        self._resolve("set_exception", EOFError("Worker job was interrupted"))
+
+
+class JobStats(object):
+    """
+    queue wait and run time histograms per callable, and slow jobs log
+    """
+    def __init__(self, threshold=DefaultSlowJobThreshold):
+        self.threshold = threshold
+        self.lock = Lock()
+        # trace delay between waker call and job start, in interleave mode
+        self.trace_interleave = False
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # name -> {"wait": histogram, "run": histogram, "waker": histogram}
+            self.jobs = {}
+            self.slow = deque(maxlen=SlowJobsCount)
+
+    def record(self, _job):
+        if _job.enqueued is None or _job.ended is None:
+            return
+        name = _job.name()
+        wait = _job.started - _job.enqueued
+        run = _job.ended - _job.started
+        with self.lock:
+            histograms = self.jobs.get(name, None)
+            if histograms is None:
+                histograms = {"wait": LatencyHistogram(),
+                              "run": LatencyHistogram(),
+                              "waker": LatencyHistogram()}
+                self.jobs[name] = histograms
+            histograms["wait"].record(wait)
+            histograms["run"].record(run)
+            if self.trace_interleave and _job.dispatched is not None:
+                histograms["waker"].record(_job.started - _job.dispatched)
+            if wait + run >= self.threshold:
+                self.slow.append((time(), name, wait, run))
+
+    def get(self):
+        """
+        return histograms summaries (microseconds) per callable name, and
+        recent slow jobs as (time, name, wait seconds, run seconds)
+        """
+        with self.lock:
+            jobs = {name: {kind: h.summary()
+                           for kind, h in histograms.items()
+                           if h.count}
+                    for name, histograms in self.jobs.items()}
+            return dict(jobs=jobs, slow=list(self.slow))
 
 
 class worker(object):
     """
     serialize main thread load/unload of PLC shared objects
+    Jobs are queued and executed one at a time, by priority, then in order.
     """
-    def __init__(self):
-        # Only one job at a time
+    def __init__(self, max_queued=DefaultMaxQueuedJobs):
         self._finish = False
         self._threadID = None
         self.mutex = Lock()
         self.todo = Condition(self.mutex)
         self.done = Condition(self.mutex)
-        self.free = Condition(self.mutex)
-        self.job = None
+        # heap of (priority, sequence, job)
+        self.queue = []
+        self.sequence = 0
+        self.max_queued = max_queued
         self.enabled = False
         self.stopper = None
         self.own_thread = None
+        self.stats = JobStats()
 
     def reraise(self, job):
         """
@@ -58,6 +194,21 @@ class worker(object):
         """
         raise job.exc_info
 
+    def _pop(self):
+        """
+        next job to be done, mutex must be held
+        """
+        return heappop(self.queue)[2]
+
+    def _cancel_queued(self):
+        """
+        wake up callers of jobs that will not be done, mutex must be held
+        """
+        for _priority, _sequence, _job in self.queue:
+            _job.cancel()
+        self.queue = []
+        self.done.notify_all()
+
     def runloop(self, *args, **kwargs):
         """
         meant to be called by worker thread (blocking)
@@ -66,22 +217,25 @@ class worker(object):
         self.mutex.acquire()
         self.enabled = True
         if args or kwargs:
-            self.job = job(*args, **kwargs)
-            self.job.do()
+            _job = job(*args, **kwargs)
+            _job.do()
             # fail if first job fails
-            if not self.job.success:
-                self.reraise(self.job)
-            self.job = None
-
-        self.free.notify()
+            if not _job.success:
+                self.reraise(_job)
 
         while not self._finish:
-            self.todo.wait_for(lambda: self.job is not None)
-            self.job.do()
-            self.done.notify()
-            self.job = None
-            self.free.notify()
-            
+            self.todo.wait_for(lambda: self.queue or self._finish)
+            if self._finish:
+                break
+            _job = self._pop()
+            # let other threads queue jobs meanwhile
+            self.mutex.release()
+            _job.do()
+            self.stats.record(_job)
+            self.mutex.acquire()
+            self.done.notify_all()
+
+        self._cancel_queued()
         self.mutex.release()
 
     def interleave(self, waker, stopper, *args, **kwargs):
@@ -89,13 +243,13 @@ class worker(object):
         as for twisted reactor's interleave, it passes all jobs to waker func
         additionaly, it creates a new thread to wait for new job.
         """
-        self.feed = Condition(self.mutex)
         self._threadID = get_ident()
         self.stopper = stopper
 
-        def do_pending_job():
+        def do_pending_job(_job):
+            _job.do()
+            self.stats.record(_job)
             self.mutex.acquire()
-            self.job.do()
             self.done.notify_all()
             self.mutex.release()
 
@@ -105,25 +259,24 @@ class worker(object):
 
             # Handle first job
             if args or kwargs:
-                self.job = job(*args, **kwargs)
-                waker(do_pending_job)
-                self.done.wait_for(lambda: self.job.success is not None)
+                _job = job(*args, **kwargs)
+                waker(partial(do_pending_job, _job))
+                self.done.wait_for(lambda: _job.success is not None)
                 # fail if first job fails
-                if not self.job.success:
-                    self.reraise(self.job)
-                self.job = None
-
-            self.free.notify()
+                if not _job.success:
+                    self.reraise(_job)
 
             while not self._finish:
-                self.todo.wait_for(lambda: self.job is not None)
+                self.todo.wait_for(lambda: self.queue or self._finish)
                 if self._finish:
                     break
-                waker(do_pending_job)
-                self.done.wait_for(lambda: self.job.success is not None)
-                self.job = None
-                self.free.notify()
+                _job = self._pop()
+                _job.dispatched = perf_counter()
+                waker(partial(do_pending_job, _job))
+                self.done.wait_for(lambda: _job.success is not None or
+                                   _job.cancelled or self._finish)
 
+            self._cancel_queued()
             self.mutex.release()
 
         self.own_thread = Thread(target = wakerfeedingloop)
@@ -136,9 +289,8 @@ class worker(object):
         self.mutex.acquire()
         self._finish = True
         self.enabled = False
-        self.job = None
+        self._cancel_queued()
         self.todo.notify()
-        self.done.notify_all()
         self.mutex.release()
         self.own_thread.join()
 
@@ -149,6 +301,12 @@ class worker(object):
         meant to be called by non-worker threads, but this is accepted.
         blocking until job done
         """
+        return self.call_priority(PriorityNormal, *args, **kwargs)
+
+    def call_priority(self, priority, *args, **kwargs):
+        """
+        same as call, job being done before queued jobs of lower priority
+        """
 
         _job = job(*args, **kwargs)
 
@@ -156,18 +314,14 @@ class worker(object):
             # if caller is worker thread execute immediately
             _job.do()
         else:
-            # otherwise notify and wait for completion
+            # otherwise queue and wait for completion
             self.mutex.acquire()
-            if not self.enabled:
+            try:
+                self._queue(priority, _job)
+            except Exception:
                 self.mutex.release()
-                raise EOFError("Worker is disabled")
-
-            self.free.wait_for(lambda: self.job is None)
-
-            self.job = _job
-            self.todo.notify()
-            self.done.wait_for(lambda: _job.success is not None)
-            self.free.notify()
+                raise
+            self.done.wait_for(lambda: _job.success is not None or _job.cancelled)
             self.mutex.release()
 
         if _job.success is None:
@@ -178,6 +332,65 @@ class worker(object):
         else:
             self.reraise(_job)
 
+    def _queue(self, priority, _job):
+        """
+        queue job for worker thread, mutex must be held
+        """
+        if not self.enabled:
+            raise EOFError("Worker is disabled")
+
+        if len(self.queue) >= self.max_queued:
+            raise WorkerQueueFull(
+                "Worker queue is full (%d jobs waiting)" % self.max_queued)
+
+        self.sequence += 1
+        _job.enqueued = perf_counter()
+        heappush(self.queue, (priority, self.sequence, _job))
+        self.todo.notify()
+
+    def submit(self, *args, **kwargs):
+        """
+        same as call, but doesn't wait for job to be done.
+        returns a concurrent.futures.Future of job result
+        """
+        return self.submit_priority(PriorityNormal, *args, **kwargs)
+
+    def submit_priority(self, priority, *args, **kwargs):
+        """
+        same as submit, job being done before queued jobs of lower priority
+        """
+        _job = job(*args, **kwargs)
+        _job.future = Future()
+
+        if self._threadID == get_ident():
+            # if caller is worker thread execute immediately
+            _job.do()
+        else:
+            self.mutex.acquire()
+            try:
+                self._queue(priority, _job)
+            except Exception as e:
+                _job.future.set_exception(e)
+            self.mutex.release()
+
+        return _job.future
+
+    def status(self):
+        """
+        return count of jobs waiting, per priority and in total,
+        and jobs timing statistics
+        """
+        self.mutex.acquire()
+        priorities = [priority for priority, _sequence, _job in self.queue]
+        self.mutex.release()
+        res = dict(queued=len(priorities),
+                   max_queued=self.max_queued,
+                   high=priorities.count(PriorityHigh),
+                   normal=priorities.count(PriorityNormal),
+                   low=priorities.count(PriorityLow))
+        res.update(self.stats.get())
+        return res
+
     def quit(self):
         """
         unblocks main thread, and terminate execution of runloop()
@@ -186,9 +399,8 @@ class worker(object):
         self._finish = True
         self.mutex.acquire()
         self.enabled = False
-        self.job = None
+        self._cancel_queued()
         self.todo.notify()
-        self.done.notify()
         self.mutex.release()
 
     def finish(self):
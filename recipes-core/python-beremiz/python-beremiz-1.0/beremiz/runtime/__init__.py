@@ -6,7 +6,7 @@
 import traceback
 import sys
 
-from runtime.Worker import worker
+from runtime.Worker import worker, DeferredFromFuture
 MainWorker = worker()
 
 _PLCObjectSingleton = None
@@ -38,3 +38,19 @@ def default_evaluator(tocall, *args, **kwargs):
     except Exception:
         res = (None, sys.exc_info())
     return res
+
+
+def DeferredCall(callee, *args, **kwargs):
+    """
+    Call callee from twisted reactor thread without blocking it : RunInMain
+    methods are submitted to MainWorker, and a Deferred result is returned.
+    Other callees are simply called.
+    """
+    priority = getattr(callee, "MainWorkerPriority", None)
+    if priority is None:
+        return callee(*args, **kwargs)
+    func = callee.__wrapped__
+    if hasattr(callee, "__self__"):
+        args = (callee.__self__,) + args
+    return DeferredFromFuture(
+        MainWorker.submit_priority(priority, func, *args, **kwargs))
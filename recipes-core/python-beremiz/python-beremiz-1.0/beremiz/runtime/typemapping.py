@@ -6,6 +6,9 @@
 
 from ctypes import *
 from datetime import timedelta as td
+import struct
+from array import array
+from functools import lru_cache
 
 class IEC_STRING(Structure):
     """
@@ -71,33 +74,222 @@ TypeTranslator = SameEndianessTypeTranslator
 DebugTypesSize = dict([(key, sizeof(t)) for key, (t, p, u) in SameEndianessTypeTranslator.items() if t is not None])
 
 
-def UnpackDebugBuffer(buff, indexes):
-    res = []
-    buffoffset = 0
-    buffsize = len(buff)
-    buffptr = cast(cast(buff, c_char_p), c_void_p).value
-    for iectype in indexes:
-        c_type, unpack_func, _pack_func = TypeTranslator.get(iectype,
-                                                             (None, None, None))
-
-        cursor = c_void_p(buffptr + buffoffset)
-        if iectype == "STRING":
-            # strlen is stored in c_uint8 and sizeof(c_uint8) is 1
-            # first check we can read size
-            if (buffoffset + 1) <= buffsize:
-                size = 1 + cast(cursor,POINTER(c_type)).contents.len
+# struct format of types that have fixed size in debug buffer.
+# Debug buffer is packed, in native byte order.
+_long_fmt = {4: "i", 8: "q"}[sizeof(c_long)]
+DebugTypesFormat = {
+    "BOOL":       "B",
+    "STEP":       "B",
+    "TRANSITION": "B",
+    "ACTION":     "B",
+    "SINT":       "b",
+    "USINT":      "B",
+    "BYTE":       "B",
+    "INT":        "h",
+    "UINT":       "H",
+    "WORD":       "H",
+    "DINT":       "i",
+    "UDINT":      "I",
+    "DWORD":      "I",
+    "LINT":       "q",
+    "ULINT":      "Q",
+    "LWORD":      "Q",
+    "REAL":       "f",
+    "LREAL":      "d",
+    "TIME":       _long_fmt * 2,
+    "TOD":        _long_fmt * 2,
+    "DATE":       _long_fmt * 2,
+    "DT":         _long_fmt * 2,
+    }
+
+
+# array typecodes of columns produced by DebugBufferDecoder.columns.
+# TIME-like types are given in nanoseconds, and STRINGs as list of str.
+DebugTypesArrayCode = dict(
+    [(iectype, "q" if len(fmt) == 2 else fmt)
+     for iectype, fmt in DebugTypesFormat.items()],
+    STRING="s")
+
+
+def _unpack_time(s, ns):
+    return td(0, s, ns/1000.0)
+
+
+DebugTypesFixup = {
+    "BOOL": bool,
+    "TIME": _unpack_time,
+    "TOD":  _unpack_time,
+    "DATE": _unpack_time,
+    "DT":   _unpack_time,
+    }
+
+
+class DebugBufferDecoder(object):
+    """
+    Decoder compiled once for a given list of IEC types, that unpacks
+    debug buffers in one pass using struct formats.
+    STRING variables split the buffer in fixed size runs.
+    """
+    def __init__(self, iectypes):
+        self.iectypes = list(iectypes)
+        self.valid = bool(self.iectypes)
+        # runs of fixed size variables, None standing for a STRING
+        self.runs = []
+        # for each variable, (first field, fields count, fixup func)
+        self.fields = []
+        fmt = ""
+        nfields = 0
+        for iectype in self.iectypes:
+            if iectype == "STRING":
+                if fmt:
+                    self.runs.append(struct.Struct("=" + fmt))
+                    fmt = ""
+                self.runs.append(None)
+                self.fields.append((nfields, 1, None))
+                nfields += 1
+                continue
+            tfmt = DebugTypesFormat.get(iectype, None)
+            if tfmt is None:
+                self.valid = False
+                break
+            self.fields.append((nfields, len(tfmt),
+                                DebugTypesFixup.get(iectype, None)))
+            nfields += len(tfmt)
+            fmt += tfmt
+        if fmt:
+            self.runs.append(struct.Struct("=" + fmt))
+        self.nfields = nfields
+        # buffer has fixed size when there is no STRING
+        self.size = self.runs[0].size \
+            if len(self.runs) == 1 and self.runs[0] is not None else None
+        # fixed offsets, only when every type is known
+        self._bounds = None
+        if self.valid and self.size is not None:
+            self._bounds = []
+            offset = 0
+            for iectype in self.iectypes:
+                size = struct.calcsize("=" + DebugTypesFormat[iectype])
+                self._bounds.append((offset, offset + size))
+                offset += size
+        self.fixups = [(idx, count, fixup)
+                       for idx, count, fixup in self.fields
+                       if fixup is not None or count != 1]
+
+    def unpack_fields(self, buff):
+        """
+        return raw struct fields of given buffer,
+        or None if buffer doesn't match types
+        """
+        if not self.valid:
+            return None
+        if self.size is not None:
+            if len(buff) != self.size:
+                return None
+            return self.runs[0].unpack(buff)
+        res = []
+        offset = 0
+        buffsize = len(buff)
+        for run in self.runs:
+            if run is None:
+                # strlen is stored in c_uint8
+                if offset + 1 > buffsize:
+                    return None
+                end = offset + 1 + buff[offset]
+                if end > buffsize:
+                    return None
+                res.append(bytes(buff[offset + 1:end]))
+                offset = end
             else:
+                if offset + run.size > buffsize:
+                    return None
+                res.extend(run.unpack_from(buff, offset))
+                offset += run.size
+        if offset != buffsize:
+            return None
+        return res
+
+    def bounds(self, buff):
+        """
+        return (start, end) offsets of each variable in given buffer,
+        or None if buffer doesn't match types
+        """
+        if not self.valid:
+            return None
+        if self.size is not None:
+            return self._bounds if len(buff) == self.size else None
+        res = []
+        offset = 0
+        buffsize = len(buff)
+        for iectype in self.iectypes:
+            if iectype == "STRING":
+                if offset + 1 > buffsize:
+                    return None
+                end = offset + 1 + buff[offset]
+            else:
+                end = offset + DebugTypesSize[iectype]
+            if end > buffsize:
                 return None
-        else:
-            size = sizeof(c_type)
-
-        if c_type is not None and (buffoffset + size) <= buffsize:
-            ptr = cast(cursor, POINTER(c_type))
-            value = unpack_func(ptr.contents)
-            buffoffset += size
-            res.append(value)
-        else:
+            res.append((offset, end))
+            offset = end
+        if offset != buffsize:
             return None
-    if buffoffset and buffoffset == buffsize:
         return res
-    return None
+
+    def decode(self, buff):
+        """
+        return list of values of given buffer,
+        or None if buffer doesn't match types
+        """
+        fields = self.unpack_fields(buff)
+        if fields is None:
+            return None
+        if not self.fixups:
+            return list(fields)
+        return [fields[idx] if fixup is None and count == 1 else
+                fixup(*fields[idx:idx + count]) if fixup is not None else
+                fields[idx:idx + count]
+                for idx, count, fixup in self.fields]
+
+    def columns(self, buffers):
+        """
+        unpack a list of buffers into one column per variable,
+        as (typecode, data) where data is packed with array module,
+        or None if any buffer doesn't match types
+        """
+        rows = []
+        for buff in buffers:
+            fields = self.unpack_fields(buff)
+            if fields is None:
+                return None
+            rows.append(fields)
+        fields = list(zip(*rows)) if rows else [()] * self.nfields
+        res = []
+        for iectype, (idx, count, _fixup) in zip(self.iectypes, self.fields):
+            typecode = DebugTypesArrayCode[iectype]
+            if typecode == "s":
+                # decoded as STRING pack encodes str
+                data = [value.decode(errors="replace") for value in fields[idx]]
+            elif count == 2:
+                data = array(typecode, [s * 1000000000 + ns for s, ns in
+                                        zip(fields[idx], fields[idx + 1])]).tobytes()
+            else:
+                data = array(typecode, fields[idx]).tobytes()
+            res.append((typecode, data))
+        return res
+
+
+@lru_cache(maxsize=32)
+def _GetDebugBufferDecoder(iectypes):
+    return DebugBufferDecoder(iectypes)
+
+
+def GetDebugBufferDecoder(iectypes):
+    """
+    return a cached decoder for given list of IEC types
+    """
+    return _GetDebugBufferDecoder(tuple(iectypes))
+
+
+def UnpackDebugBuffer(buff, indexes):
+    return GetDebugBufferDecoder(indexes).decode(buff)
+